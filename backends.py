@@ -0,0 +1,292 @@
+import os
+import resource
+import shutil
+import threading
+import time
+
+from governor import get_governor
+from probe import run_ffprobe
+from progress import DEFAULT_PROGRESS_INTERVAL, FFmpegResult, ProgressEvent, run_ffmpeg
+
+DEFAULT_BACKEND = "subprocess"
+
+def seek_args(input_file, start_time=None, duration=None):
+    if start_time is None:
+        return ["-i", input_file]
+    # Input-side seeking: ffmpeg jumps straight to the start point instead of decoding up to it, and -t as an
+    # input option applies to every output of the command
+    return ["-ss", str(start_time), "-t", str(duration), "-i", input_file]
+
+class SubprocessBackend:
+    # Runs the ffmpeg and ffprobe executables; a process per call, but every codec and muxer ffmpeg has
+    name = "subprocess"
+
+    def check(self):
+        if shutil.which("ffmpeg") is None:
+            raise Exception("FFmpeg is not installed. Please install it using 'sudo apt-get install ffmpeg'.")
+
+    def probe(self, input_file):
+        return run_ffprobe(input_file)
+
+    def convert_audio(self, input_file, output_file, codec, start_time=None, duration=0.0, progress_callback=None,
+                      event_callback=None, interval=DEFAULT_PROGRESS_INTERVAL, control=None, audio_filter=None):
+        command = ["ffmpeg"] + seek_args(input_file, start_time, duration) + ["-vn"]
+        if audio_filter:
+            command += ["-af", audio_filter]
+        command += [
+            "-acodec", codec,
+            "-y",  # Overwrite output file if it exists
+            output_file
+        ]
+        return run_ffmpeg(command, duration, progress_callback, event_callback, interval, control)
+
+    def cut(self, input_file, output_file, start_time, end_time, control=None):
+        command = [
+            "ffmpeg",
+            "-i", input_file,
+            "-ss", str(start_time),
+            "-to", str(end_time),
+            "-c", "copy",
+            "-y",  # Overwrite output file if it exists
+            output_file
+        ]
+        return run_ffmpeg(command, end_time - start_time, control=control)
+
+class _Progress:
+    # Emits the same ProgressEvent stream, at the same rate, as run_ffmpeg does for the subprocess backend
+    def __init__(self, total_duration, progress_callback, event_callback, interval):
+        self.total_duration = total_duration
+        self.progress_callback = progress_callback
+        self.event_callback = event_callback
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_emit = 0.0
+        self.last_event = None
+
+    def update(self, out_time, total_size, finished=False):
+        now = time.monotonic()
+        elapsed = now - self.started
+        speed = out_time / elapsed if elapsed > 0 else 0.0
+        bitrate = total_size * 8 / 1000 / out_time if out_time > 0 else 0.0
+        self.last_event = ProgressEvent(out_time, self.total_duration, speed, bitrate, total_size, finished)
+        if finished or now - self.last_emit >= self.interval:
+            self.last_emit = now
+            if self.progress_callback:
+                self.progress_callback(self.last_event.percent)
+            if self.event_callback:
+                self.event_callback(self.last_event)
+
+class PyAVBackend:
+    # Decodes and encodes in-process through libav, so thousands of short files do not pay for a process each.
+    # Trims land on decoded frame boundaries (a few milliseconds) rather than exact samples.
+    name = "pyav"
+
+    def check(self):
+        try:
+            import av  # noqa: F401
+        except ImportError:
+            raise Exception("PyAV is not installed. Please install it using 'pip install av'.")
+
+    def probe(self, input_file):
+        import av
+
+        try:
+            with av.open(input_file) as container:
+                video = container.streams.video[0] if container.streams.video else None
+                audio = container.streams.audio[0] if container.streams.audio else None
+                chapters = [{"start": float(chapter["start"] * chapter["time_base"]),
+                             "end": float(chapter["end"] * chapter["time_base"]),
+                             "title": chapter["metadata"].get("title", "")}
+                            for chapter in container.chapters()]
+                return {
+                    "duration": container.duration / av.time_base if container.duration else 0.0,
+                    "format_name": container.format.name,
+                    "bit_rate": container.bit_rate or 0,
+                    "video_codec": video.codec_context.name if video else None,
+                    "audio_codec": audio.codec_context.name if audio else None,
+                    "audio_bit_rate": (audio.bit_rate or 0) if audio else 0,
+                    "channels": audio.codec_context.layout.nb_channels if audio else 0,
+                    "sample_rate": audio.rate if audio else 0,
+                    "sample_fmt": audio.codec_context.format.name if audio and audio.codec_context.format else None,
+                    # PyAV does not expose bits_per_raw_sample
+                    "bits_per_sample": 0,
+                    "audio_streams": len(container.streams.audio),
+                    "chapters": chapters,
+                }
+        except av.error.FFmpegError as e:
+            raise Exception(f"Could not read media information from {input_file}: {e}")
+
+    def _run(self, work, duration, progress_callback, event_callback, interval, control):
+        # Same contract as run_ffmpeg: governed, cancellable, and failures come back as a non-zero return code
+        import av
+
+        governor = get_governor()
+        requested = time.monotonic()
+        profile, threads = governor.acquire(control) if governor is not None else (None, 0)
+        wait_time = time.monotonic() - requested
+        progress = _Progress(duration, progress_callback, event_callback, interval)
+        cpu_before = resource.getrusage(resource.RUSAGE_THREAD)
+        returncode, error = 0, ""
+        try:
+            work(progress, threads, control)
+        except av.codec.codec.UnknownCodecError as e:
+            returncode, error = 1, f"Unknown encoder '{e}' (not included in this PyAV build)"
+        except av.error.FFmpegError as e:
+            returncode, error = 1, str(e)
+        finally:
+            if governor is not None:
+                governor.release(threads)
+        cpu_after = resource.getrusage(resource.RUSAGE_THREAD)
+        cpu_time = (cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime)
+        return FFmpegResult(returncode, error, progress.last_event, time.monotonic() - progress.started, 0.0,
+                            cpu_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, wait_time)
+
+    def convert_audio(self, input_file, output_file, codec, start_time=None, duration=0.0, progress_callback=None,
+                      event_callback=None, interval=DEFAULT_PROGRESS_INTERVAL, control=None, audio_filter=None):
+        import av
+
+        if audio_filter and codec == "copy":
+            raise Exception("Audio filters need the audio to be re-encoded.")
+
+        start = start_time or 0.0
+
+        def work(progress, threads, control):
+            with av.open(input_file) as source, av.open(output_file, "w") as target:
+                if not source.streams.audio:
+                    raise Exception(f"{input_file} has no audio stream.")
+                in_stream = source.streams.audio[0]
+                if codec == "copy":
+                    out_stream = target.add_stream_from_template(in_stream)
+                else:
+                    # Encoders missing from the PyAV build (its wheels ship without libvorbis) fail like ffmpeg would
+                    out_stream = target.add_stream(codec, rate=in_stream.rate, layout=in_stream.layout)
+                    if threads:
+                        out_stream.codec_context.thread_count = threads
+                graph = _filter_graph(audio_filter, in_stream) if audio_filter else None
+                if start_time is not None:
+                    source.seek(int(start / in_stream.time_base), stream=in_stream)
+                end = start + duration if start_time is not None else None
+
+                for packet in source.demux(in_stream):
+                    if control is not None:
+                        control.checkpoint()
+                    if packet.pts is None:
+                        continue
+                    packet_time = float(packet.pts * in_stream.time_base)
+                    if end is not None and packet_time >= end:
+                        break
+                    if codec == "copy":
+                        if packet_time < start:
+                            continue
+                        packet.pts -= int(start / in_stream.time_base)
+                        packet.dts = packet.pts
+                        packet.stream = out_stream
+                        target.mux(packet)
+                    else:
+                        for frame in packet.decode():
+                            frame_time = float(frame.pts * in_stream.time_base) if frame.pts is not None else 0.0
+                            if frame_time < start:
+                                continue
+                            for filtered in _filter_frame(graph, frame):
+                                filtered.pts = None
+                                target.mux(out_stream.encode(filtered))
+                    progress.update(packet_time - start, 0)
+                if codec != "copy":
+                    for filtered in _filter_frame(graph, None):
+                        filtered.pts = None
+                        target.mux(out_stream.encode(filtered))
+                    target.mux(out_stream.encode(None))
+            progress.update(duration, os.path.getsize(output_file), finished=True)
+
+        return self._run(work, duration, progress_callback, event_callback, interval, control)
+
+    def cut(self, input_file, output_file, start_time, end_time, control=None):
+        import av
+
+        def work(progress, threads, control):
+            with av.open(input_file) as source, av.open(output_file, "w") as target:
+                streams = [stream for stream in source.streams if stream.type in ("video", "audio")]
+                outputs = {stream.index: target.add_stream_from_template(stream) for stream in streams}
+                # Like a stream copy with -ss, the cut starts at the keyframe at or before the start time
+                anchor = source.streams.video[0] if source.streams.video else streams[0]
+                source.seek(int(start_time / anchor.time_base), stream=anchor)
+                # Every stream is shifted by the same amount of time so audio and video stay in sync
+                base_time = None
+                for packet in source.demux(streams):
+                    if control is not None:
+                        control.checkpoint()
+                    if packet.dts is None:
+                        continue
+                    stream = packet.stream
+                    packet_time = float(packet.pts * stream.time_base) if packet.pts is not None else None
+                    if packet_time is not None and packet_time >= end_time:
+                        continue
+                    if base_time is None:
+                        base_time = float(packet.dts * stream.time_base)
+                    offset = round(base_time / stream.time_base)
+                    if packet.dts < offset:
+                        continue
+                    packet.dts -= offset
+                    if packet.pts is not None:
+                        packet.pts -= offset
+                    packet.stream = outputs[stream.index]
+                    target.mux(packet)
+                    if packet_time is not None:
+                        progress.update(max(0.0, packet_time - start_time), 0)
+            progress.update(end_time - start_time, os.path.getsize(output_file), finished=True)
+
+        return self._run(work, end_time - start_time, None, None, DEFAULT_PROGRESS_INTERVAL, control)
+
+def _filter_graph(audio_filter, in_stream):
+    # A plain chain in ffmpeg's -af syntax; none of the filters this project builds has a comma in its options
+    import av
+
+    graph = av.filter.Graph()
+    nodes = [graph.add_abuffer(template=in_stream)]
+    for description in audio_filter.split(","):
+        name, _, args = description.partition("=")
+        nodes.append(graph.add(name, args or None))
+    nodes.append(graph.add("abuffersink"))
+    graph.link_nodes(*nodes).configure()
+    return graph
+
+def _filter_frame(graph, frame):
+    # The frames the graph has ready after taking this one; None flushes it
+    import av
+
+    if graph is None:
+        if frame is not None:
+            yield frame
+        return
+    graph.push(frame)
+    while True:
+        try:
+            yield graph.pull()
+        except (av.error.BlockingIOError, av.error.EOFError):
+            return
+
+BACKENDS = {
+    SubprocessBackend.name: SubprocessBackend,
+    PyAVBackend.name: PyAVBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise Exception(f"Unknown backend: {name}. Use one of: {', '.join(BACKENDS)}.")
+    with _backend_lock:
+        _backend = BACKENDS[name]()
+    return _backend
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.environ.get("VIDEO_CONVERTER_BACKEND", DEFAULT_BACKEND)
+            if name not in BACKENDS:
+                raise Exception(f"Unknown backend: {name}. Use one of: {', '.join(BACKENDS)}.")
+            _backend = BACKENDS[name]()
+        return _backend
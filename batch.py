@@ -0,0 +1,354 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from backends import SubprocessBackend, get_backend
+from conversion import choose_audio_codec, convert_group, convert_video_to_audio
+from estimator import predict_conversion_time
+from loudness import measure_many
+from probe import probe_many
+from progress import JobCancelled, JobControl
+
+# Inputs this short are small enough that starting ffmpeg dominates their conversion time, so they are converted
+# several to a command; the size limit only stands in when the duration is unknown, since a long low-bitrate file
+# is small on disk but would tie up the group's single encoder thread
+GROUP_MAX_DURATION = 30.0
+GROUP_MAX_BYTES = 20 * 1024 * 1024
+GROUP_SIZE = 16
+
+def default_worker_count():
+    return max(1, os.cpu_count() or 1)
+
+class BatchJob:
+    def __init__(self, input_file, output_file, output_format, start_time=None, end_time=None, priority=0,
+                 mode="auto", loudness_target=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.output_format = output_format
+        self.start_time = start_time
+        self.end_time = end_time
+        self.priority = priority
+        self.mode = mode
+        self.loudness_target = loudness_target
+        self.status = "pending"
+        self.progress = 0
+        self.attempts = 0
+        self.error = None
+        self.result = None
+        self.estimated_time = None
+        self.media_duration = None
+        self.control = JobControl()
+        self.group = None
+
+    def estimate(self, info):
+        duration = info["duration"]
+        if self.start_time is not None and self.end_time is not None:
+            duration = max(0.0, min(self.end_time, duration) - self.start_time)
+        # Only set for inputs with audio, which are the ones that can share a command
+        self.media_duration = duration if info["audio_codec"] else None
+        _, mode = choose_audio_codec(info["audio_codec"], self.output_format, self.mode)
+        self.estimated_time = predict_conversion_time(duration, self.output_format, mode)[0]
+        return self.estimated_time
+
+    def run(self, progress_callback):
+        self.result = convert_video_to_audio(self.input_file, self.output_file, self.output_format, progress_callback,
+                                             self.start_time, self.end_time, self.mode, control=self.control,
+                                             loudness_target=self.loudness_target)
+
+    def is_small(self):
+        # A grouped command has no per-output filters, so normalized jobs always run on their own
+        if self.media_duration is None or self.loudness_target is not None:
+            return False
+        if self.media_duration > 0:
+            return self.media_duration <= GROUP_MAX_DURATION
+        try:
+            return os.path.getsize(self.input_file) <= GROUP_MAX_BYTES
+        except OSError:
+            return False
+
+    def cancel(self):
+        self.control.cancel()
+        # The ffmpeg a grouped job runs in belongs to its group
+        group = self.group
+        if group is not None:
+            group.control.cancel()
+
+    def pause(self):
+        self.control.pause()
+        group = self.group
+        if group is not None:
+            group.control.pause()
+
+    def resume(self):
+        self.control.resume()
+        group = self.group
+        if group is not None:
+            group.control.resume()
+
+class JobGroup:
+    # Several small jobs converted by one ffmpeg; members it could not convert go back to the queue on their own
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.priority = max(job.priority for job in jobs)
+        self.estimated_time = sum(job.estimated_time or 0 for job in jobs)
+        self.control = JobControl()
+        for job in jobs:
+            job.group = self
+
+    def run(self, progress_callback):
+        items = [(job.input_file, job.output_file, job.output_format, job.start_time, job.end_time, job.mode)
+                 for job in self.jobs]
+        results = convert_group(items, lambda index, value: progress_callback(self.jobs[index], value),
+                                control=self.control)
+        for job, result in zip(self.jobs, results):
+            if result["success"]:
+                job.result = result
+                job.status = "done"
+                job.progress = 100
+                job.error = None
+            else:
+                job.error = result["error"]
+
+class BatchQueue:
+    def __init__(self, workers=None, retries=1, progress_callback=None, job_callback=None, group_size=GROUP_SIZE):
+        self.workers = workers or default_worker_count()
+        self.retries = retries
+        self.group_size = group_size
+        self.progress_callback = progress_callback
+        self.job_callback = job_callback
+        self.jobs = []
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._threads = []
+        self._paused = False
+
+    def add_job(self, input_file, output_file, output_format, start_time=None, end_time=None, priority=0, mode="auto"):
+        job = BatchJob(input_file, output_file, output_format, start_time, end_time, priority, mode)
+        self.submit(job)
+        return job
+
+    def submit(self, job):
+        with self._condition:
+            self.jobs.append(job)
+            self._push(job)
+            self._condition.notify()
+
+    def _push(self, job):
+        # Higher priority first, then the longest estimated jobs so the tail of the batch stays short
+        heapq.heappush(self._heap, (-job.priority, -(job.estimated_time or 0), next(self._counter), job))
+        self._pending += 1
+
+    def estimate_jobs(self):
+        jobs = [job for job in self.jobs if job.estimated_time is None]
+        infos = probe_many(sorted({job.input_file for job in jobs}))
+        for job in jobs:
+            info = infos.get(job.input_file)
+            job.estimated_time = job.estimate(info) if info else 0.0
+
+        with self._condition:
+            self._heap = [(-job.priority, -job.estimated_time, order, job) for _, _, order, job in self._heap]
+            heapq.heapify(self._heap)
+
+    def measure_loudness(self):
+        # The analysis pass for every normalized job runs up front and in parallel, so the encodes that follow
+        # find their measurements cached
+        jobs = [job for job in self.jobs if job.loudness_target is not None and job.status == "pending"]
+        items = sorted({(job.input_file, job.start_time, job.end_time) for job in jobs}, key=str)
+        if items:
+            measure_many(items, self.workers)
+
+    def group_jobs(self):
+        # Grouping saves process launches, which only the subprocess backend pays for
+        if self.group_size < 2 or get_backend().name != SubprocessBackend.name:
+            return []
+        with self._condition:
+            small = {}
+            for entry in self._heap:
+                job = entry[-1]
+                if isinstance(job, BatchJob) and job.is_small():
+                    small.setdefault(job.priority, []).append(entry)
+            groups = []
+            for entries in small.values():
+                for first in range(0, len(entries), self.group_size):
+                    chunk = entries[first:first + self.group_size]
+                    if len(chunk) > 1:
+                        groups.append((chunk, JobGroup([entry[-1] for entry in chunk])))
+            grouped = {id(entry[-1]) for chunk, _ in groups for entry in chunk}
+            self._heap = [entry for entry in self._heap if id(entry[-1]) not in grouped]
+            heapq.heapify(self._heap)
+            self._pending -= len(grouped)
+            for _, group in groups:
+                self._push(group)
+            return [group for _, group in groups]
+
+    def start(self):
+        self.estimate_jobs()
+        self.measure_loudness()
+        self.group_jobs()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self):
+        with self._condition:
+            while self._pending:
+                self._condition.wait()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self.jobs
+
+    def run(self):
+        self.start()
+        return self.wait()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while (not self._heap or self._paused) and self._pending:
+                    self._condition.wait()
+                if not self._heap:
+                    return
+                job = heapq.heappop(self._heap)[-1]
+                if isinstance(job, JobGroup):
+                    for member in job.jobs:
+                        member.status = "running"
+                else:
+                    job.status = "running"
+                    job.attempts += 1
+
+            if isinstance(job, JobGroup):
+                self._run_group(job)
+                continue
+
+            try:
+                job.run(lambda value, job=job: self._update_progress(job, value))
+                job.status = "done"
+                job.progress = 100
+                job.error = None
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+
+            with self._condition:
+                self._pending -= 1
+                if job.status == "failed" and job.attempts <= self.retries:
+                    job.status = "pending"
+                    job.progress = 0
+                    self._push(job)
+                self._condition.notify_all()
+
+            self._report_progress()
+            if job.status != "pending" and self.job_callback:
+                self.job_callback(job)
+
+    def _run_group(self, group):
+        try:
+            group.run(self._update_progress)
+        except Exception:
+            # Cancelled, or the group could not start at all; either way each member is settled below
+            pass
+
+        finished = []
+        with self._condition:
+            self._pending -= 1
+            for job in group.jobs:
+                job.group = None
+                if job.status == "done":
+                    finished.append(job)
+                elif job.control.cancelled:
+                    job.status = "cancelled"
+                    finished.append(job)
+                else:
+                    # Converted on its own instead, which does not count against its retries
+                    job.status = "pending"
+                    job.progress = 0
+                    self._push(job)
+            self._condition.notify_all()
+
+        self._report_progress()
+        if self.job_callback:
+            for job in finished:
+                self.job_callback(job)
+
+    def cancel(self, job=None):
+        # Without a job, cancels everything: queued jobs are dropped and running ffmpeg processes are stopped
+        with self._condition:
+            if job is not None and not any(entry[-1] is job for entry in self._heap):
+                dropped = []
+            else:
+                dropped = [entry[-1] for entry in self._heap if job is None or entry[-1] is job]
+                self._heap = [entry for entry in self._heap if entry[-1] not in dropped]
+                heapq.heapify(self._heap)
+                self._pending -= len(dropped)
+            dropped = [member for queued in dropped
+                       for member in (queued.jobs if isinstance(queued, JobGroup) else [queued])]
+            for dropped_job in dropped:
+                dropped_job.status = "cancelled"
+            running = [job] if job is not None else [queued for queued in self.jobs if queued.status == "running"]
+            if job is None:
+                self._paused = False
+            self._condition.notify_all()
+
+        for running_job in running:
+            running_job.cancel()
+        if self.job_callback:
+            for dropped_job in dropped:
+                self.job_callback(dropped_job)
+
+    def pause(self):
+        # Stops handing out queued jobs and suspends the ffmpeg processes of running ones
+        with self._condition:
+            self._paused = True
+            running = [job for job in self.jobs if job.status == "running"]
+        for job in running:
+            job.pause()
+
+    def resume(self):
+        with self._condition:
+            self._paused = False
+            running = [job for job in self.jobs if job.status == "running"]
+            self._condition.notify_all()
+        for job in running:
+            job.resume()
+
+    def shutdown(self, cancel=False, timeout=None):
+        # Drains the queue, or aborts it with cancel=True; returns False if workers are still busy after timeout
+        if cancel:
+            self.cancel()
+        else:
+            self.resume()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        return not self._threads
+
+    def _update_progress(self, job, value):
+        job.progress = value
+        self._report_progress()
+
+    def aggregate_progress(self):
+        if not self.jobs:
+            return 0
+        # Weight each job by its estimated time so long jobs move the bar more than short ones
+        weights = [max(job.estimated_time or 0, 1.0) for job in self.jobs]
+        return int(sum(job.progress * weight for job, weight in zip(self.jobs, weights)) / sum(weights))
+
+    def _report_progress(self):
+        if self.progress_callback:
+            self.progress_callback(self.aggregate_progress())
+
+def convert_batch(jobs, workers=None, retries=1, progress_callback=None, job_callback=None, group_size=GROUP_SIZE):
+    queue = BatchQueue(workers, retries, progress_callback, job_callback, group_size)
+    for job in jobs:
+        queue.submit(job)
+    return queue.run()
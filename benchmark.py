@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from backends import DEFAULT_BACKEND, set_backend
+from conversion import AUDIO_CODECS, convert_video_to_audio, cut_video, get_video_duration
+from probe import probe
+from progress import collect_results
+
+# (name, duration in seconds, container, video codec, audio codec)
+FIXTURES = [
+    # Process start-up dominates clips this short, which is where the in-process backend should pay off
+    ("clip_h264_aac", 2, "mp4", "libx264", "aac"),
+    ("short_h264_aac", 10, "mp4", "libx264", "aac"),
+    ("medium_h264_aac", 120, "mp4", "libx264", "aac"),
+    ("medium_vp9_opus", 120, "webm", "libvpx-vp9", "libopus"),
+    ("long_mpeg4_mp3", 600, "mkv", "mpeg4", "libmp3lame"),
+]
+
+CUT_OFFSETS = [0.0, 0.25, 0.5, 0.9]
+CUT_LENGTH = 5.0
+
+def generate_fixture(directory, name, duration, container, video_codec, audio_codec):
+    path = os.path.join(directory, f"{name}.{container}")
+    if os.path.exists(path):
+        return path
+    command = [
+        "ffmpeg", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=320x240:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", video_codec, "-g", "50",
+        "-c:a", audio_codec,
+        "-shortest", "-y", path
+    ]
+    subprocess.run(command, check=True)
+    return path
+
+def measure(function, *args, **kwargs):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    with collect_results() as ffmpeg_results:
+        function(*args, **kwargs)
+    wall_time = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "wall_time": wall_time,
+        "child_cpu_time": (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+        # The in-process backend does its work here rather than in a child
+        "self_cpu_time": (self_after.ru_utime - self_before.ru_utime) + (self_after.ru_stime - self_before.ru_stime),
+        # RUSAGE_CHILDREN only keeps a high-water mark over every child so far, so this comes from the rusage of
+        # this run's own ffmpeg processes instead; None when the run started none
+        "peak_child_rss_kb": max((result.peak_rss_kb for result in ffmpeg_results), default=None),
+    }
+
+def run_benchmarks(fixture_dir, repeat=1, backends=(DEFAULT_BACKEND,)):
+    results = {}
+    for backend in backends:
+        set_backend(backend)
+        # Keys for the default backend keep their old names so earlier baselines still compare
+        prefix = "" if backend == DEFAULT_BACKEND else f"{backend}/"
+        for key, result in _run_backend_benchmarks(fixture_dir, repeat, backend == DEFAULT_BACKEND).items():
+            results[prefix + key] = result
+    set_backend(DEFAULT_BACKEND)
+    return results
+
+def _run_backend_benchmarks(fixture_dir, repeat, smart_cuts=True):
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, duration, container, video_codec, audio_codec in FIXTURES:
+            input_file = generate_fixture(fixture_dir, name, duration, container, video_codec, audio_codec)
+
+            # Keyed by format: aac and m4a share an encoder
+            for output_format in AUDIO_CODECS:
+                output_file = os.path.join(output_dir, f"{name}.{output_format}")
+                try:
+                    samples = [measure(convert_video_to_audio, input_file, output_file, output_format, None,
+                                       use_cache=False)
+                               for _ in range(repeat)]
+                except Exception as e:
+                    # e.g. an encoder the PyAV build does not ship
+                    results[f"convert/{name}/{output_format}"] = {"error": str(e).splitlines()[-1]}
+                    continue
+                results[f"convert/{name}/{output_format}"] = summarize(samples, duration)
+
+            for offset in CUT_OFFSETS:
+                start_time = duration * offset
+                end_time = min(duration, start_time + CUT_LENGTH)
+                output_file = os.path.join(output_dir, f"{name}_cut.{container}")
+                samples = [measure(cut_video, input_file, output_file, start_time, end_time, use_cache=False)
+                           for _ in range(repeat)]
+                results[f"cut/{name}/{offset:.2f}"] = summarize(samples, end_time - start_time)
+                if not smart_cuts:
+                    # Smart cuts always run through ffmpeg, whatever the backend
+                    continue
+                samples = [measure(cut_video, input_file, output_file, start_time, end_time, use_cache=False,
+                                   mode="smart")
+                           for _ in range(repeat)]
+                results[f"cut-smart/{name}/{offset:.2f}"] = summarize(samples, end_time - start_time)
+
+            results[f"probe/{name}/cold"] = summarize([measure(probe, input_file, use_cache=False)
+                                                       for _ in range(repeat)])
+            # Cached runs read back what this stores
+            probe(input_file)
+            results[f"probe/{name}/cached"] = summarize([measure(get_video_duration, input_file)
+                                                         for _ in range(repeat)])
+    return results
+
+def summarize(samples, media_duration=None):
+    best = min(samples, key=lambda sample: sample["wall_time"])
+    summary = dict(best)
+    if media_duration:
+        summary["realtime_factor"] = media_duration / best["wall_time"] if best["wall_time"] > 0 else 0.0
+    return summary
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, result in sorted(results.items()):
+        previous = baseline.get(key)
+        if not previous or "wall_time" not in result or previous.get("wall_time", 0) <= 0:
+            continue
+        change = result["wall_time"] / previous["wall_time"] - 1
+        result["change_vs_baseline"] = change
+        if change > threshold:
+            regressions.append(f"{key}: {previous['wall_time']:.3f}s -> {result['wall_time']:.3f}s ({change:+.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the convert, cut and probe paths.")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "video-converter-fixtures"),
+                        help="directory for generated fixtures (reused between runs)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the fastest is reported")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="compare against a previously saved JSON report")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression")
+    parser.add_argument("--backends", default=DEFAULT_BACKEND,
+                        help="comma-separated backends to measure, e.g. subprocess,pyav")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.fixtures, exist_ok=True)
+    # Benchmark jobs would otherwise land in the user's probe cache, throughput model and metrics log; the caches
+    # are opened lazily, so this has to happen before the first job
+    previous_cache_home = os.environ.get("XDG_CACHE_HOME")
+    with tempfile.TemporaryDirectory() as cache_home:
+        os.environ["XDG_CACHE_HOME"] = cache_home
+        try:
+            results = run_benchmarks(args.fixtures, args.repeat, args.backends.split(","))
+        finally:
+            if previous_cache_home is None:
+                del os.environ["XDG_CACHE_HOME"]
+            else:
+                os.environ["XDG_CACHE_HOME"] = previous_cache_home
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    for regression in regressions:
+        sys.stderr.write(f"regression: {regression}\n")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import default_worker_count
+from conversion import check_ffmpeg, check_time_range, choose_audio_codec, convert_video_to_audio
+from probe import probe
+from progress import discard, format_error, partial_path, run_ffmpeg
+
+# Chunks shorter than this are not worth the extra process and stitching
+MIN_CHUNK_DURATION = 60.0
+# Every chunk but the first is decoded from this much earlier, so lossy decoders have the previous frames they
+# overlap with; output-side -ss and -t then trim the decoded audio to the exact sample
+PREROLL = 1.0
+
+# Parts are WAV files joined with the concat demuxer. WAV output keeps its own codec in the parts; FLAC frames
+# carry absolute sample numbers and cannot be joined by copying, so FLAC is cut as PCM and only the cheap final
+# FLAC encode runs once over the whole timeline. Lossy formats always go through the single pass: stream-copied
+# parts can only be cut at packet boundaries and each carries its own encoder delay and padding, so the seams
+# would not be gapless.
+CHUNKED_FORMATS = {"wav", "flac"}
+
+# PCM codec that holds each decoded sample format without loss, so the final encode sees exactly what a single
+# pass would have fed it
+PCM_PART_CODECS = {
+    "u8": "pcm_u8",
+    "s16": "pcm_s16le",
+    "flt": "pcm_f32le",
+    "dbl": "pcm_f64le",
+}
+
+def can_convert_in_chunks(output_format):
+    return output_format in CHUNKED_FORMATS
+
+def pcm_part_codec(info):
+    # None when the source sample format is unknown, which sends the conversion through the single pass
+    sample_fmt = (info.get("sample_fmt") or "").rstrip("p")
+    if sample_fmt == "s32":
+        bits = info.get("bits_per_sample") or 0
+        if 0 < bits <= 24:
+            return "pcm_s24le"
+        return "pcm_s32le" if bits == 32 else None
+    return PCM_PART_CODECS.get(sample_fmt)
+
+def plan_chunks(start, end, chunks):
+    duration = end - start
+    chunks = max(1, min(chunks, int(duration // MIN_CHUNK_DURATION)))
+    length = duration / chunks
+    return [(start + i * length, start + (i + 1) * length if i < chunks - 1 else end) for i in range(chunks)]
+
+def _escape_concat_path(path):
+    return path.replace("'", "'\\''")
+
+def convert_in_chunks(input_file, output_file, output_format, progress_callback=None, start_time=None, end_time=None,
+                      chunks=None, mode="auto", control=None):
+    if not check_ffmpeg():
+        raise Exception("FFmpeg is not installed. Please install it using 'sudo apt-get install ffmpeg'.")
+    check_time_range(start_time, end_time)
+
+    info = probe(input_file)
+    codec, mode = choose_audio_codec(info["audio_codec"], output_format, mode)
+    ranged = start_time is not None and end_time is not None
+    start = start_time if ranged else 0.0
+    end = min(end_time, info["duration"]) if ranged else info["duration"]
+    plan = plan_chunks(start, end, chunks or default_worker_count())
+
+    part_codec = pcm_part_codec(info) if output_format == "flac" else None
+
+    # Stream copies are already I/O-bound, and some formats cannot be stitched; both go through the single pass,
+    # and the result says why so callers can tell the user their --chunks had no effect
+    fallback = None
+    if mode == "copy":
+        fallback = "stream copies are not split into chunks"
+    elif not can_convert_in_chunks(output_format):
+        fallback = f"{output_format} parts encoded separately cannot be joined without gaps"
+    elif output_format == "flac" and part_codec is None:
+        fallback = "the source sample format is unknown"
+    elif len(plan) == 1:
+        fallback = f"the audio is too short to split into chunks of at least {MIN_CHUNK_DURATION:g} seconds"
+    if fallback is not None:
+        result = convert_video_to_audio(input_file, output_file, output_format, progress_callback, start_time,
+                                        end_time, mode, control=control)
+        return dict(result, chunks=1, fallback=fallback)
+
+    join_codec = codec if part_codec else "copy"
+    work_dir = tempfile.mkdtemp(prefix=".chunks_", dir=os.path.dirname(os.path.abspath(output_file)))
+    weights = [chunk_end - chunk_start for chunk_start, chunk_end in plan]
+    progress = [0] * len(plan)
+    lock = threading.Lock()
+
+    def report(index, value):
+        with lock:
+            progress[index] = value
+            # The final stitch is cheap, so encoding accounts for 95% of the bar
+            total = int(sum(p * w for p, w in zip(progress, weights)) / sum(weights) * 0.95)
+        if progress_callback:
+            progress_callback(total)
+
+    def encode(index):
+        chunk_start, chunk_end = plan[index]
+        preroll = min(PREROLL, chunk_start)
+        part_file = os.path.join(work_dir, f"part_{index:04d}.wav")
+        command = ["ffmpeg"]
+        # Any seek, even to 0, changes how ffmpeg drops the codec's priming samples, so a chunk that starts at
+        # the beginning reads the input exactly like the single pass does
+        if chunk_start - preroll > 0:
+            command += ["-ss", str(chunk_start - preroll)]
+        command += ["-i", input_file]
+        if preroll > 0:
+            command += ["-ss", str(preroll)]
+        # Without a range the last chunk runs to the end of the stream, which can be a little past the container
+        # duration the plan is based on
+        if index < len(plan) - 1 or ranged:
+            command += ["-t", str(chunk_end - chunk_start)]
+        command += [
+            "-vn",
+            "-acodec", part_codec or codec,
+            "-y", part_file
+        ]
+        result = run_ffmpeg(command, chunk_end - chunk_start, lambda value: report(index, value), control=control)
+        if result.returncode != 0:
+            raise Exception(format_error("Chunk conversion failed. Check if the input file is valid.", result))
+        return part_file
+
+    partial_file = partial_path(output_file)
+    try:
+        with ThreadPoolExecutor(max_workers=min(len(plan), default_worker_count())) as executor:
+            parts = list(executor.map(encode, range(len(plan))))
+
+        list_file = os.path.join(work_dir, "parts.txt")
+        with open(list_file, "w") as f:
+            for part_file in parts:
+                f.write(f"file '{_escape_concat_path(part_file)}'\n")
+
+        command = ["ffmpeg", "-f", "concat", "-safe", "0", "-i", list_file, "-acodec", join_codec, "-y",
+                   partial_file]
+        result = run_ffmpeg(command, end - start, control=control)
+        if result.returncode != 0:
+            raise Exception(format_error("Joining the converted chunks failed.", result))
+        os.replace(partial_file, output_file)
+    finally:
+        discard(partial_file)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if progress_callback:
+        progress_callback(100)
+    return {"output_file": output_file, "mode": mode, "codec": codec, "chunks": len(plan)}
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import sys
+
+# Only the standard library is imported up front; each command pulls in what it needs,
+# and Qt is only loaded for the gui command.
+
+def print_progress(value):
+    sys.stderr.write(f"\r{value:3d}%")
+    sys.stderr.flush()
+    if value >= 100:
+        sys.stderr.write("\n")
+
+def output_format_for(output_file, output_format):
+    if output_format:
+        return output_format
+    return os.path.splitext(output_file)[1].lstrip(".").lower()
+
+def apply_service_options(args):
+    if getattr(args, "backend", None):
+        from backends import set_backend
+
+        set_backend(args.backend)
+    if getattr(args, "policy", None):
+        from governor import load_policy, set_governor
+
+        set_governor(load_policy(args.policy))
+    if getattr(args, "metrics_port", None):
+        from metrics import get_metrics_recorder
+
+        get_metrics_recorder().serve(args.metrics_port)
+
+def convert_command(args):
+    apply_service_options(args)
+    output_format = output_format_for(args.output, args.format)
+    progress_callback = None if args.quiet else print_progress
+    if args.loudness is not None and (args.trim_silence or args.cut_internal_silence or args.chunks):
+        raise Exception("--loudness cannot be combined with --chunks or silence trimming.")
+    if args.trim_silence or args.cut_internal_silence:
+        from silence import convert_without_silence
+
+        result = convert_without_silence(args.input, args.output, output_format, progress_callback,
+                                         args.silence_threshold, args.silence_min_duration,
+                                         args.cut_internal_silence, mode=args.mode)
+    elif args.chunks:
+        from chunked import convert_in_chunks
+
+        result = convert_in_chunks(args.input, args.output, output_format, progress_callback, args.start, args.end,
+                                   args.chunks, args.mode)
+        if "fallback" in result:
+            sys.stderr.write(f"warning: converted in a single pass: {result['fallback']}\n")
+    else:
+        from conversion import convert_video_to_audio
+
+        result = convert_video_to_audio(args.input, args.output, output_format, progress_callback,
+                                        args.start, args.end, args.mode, use_cache=not args.no_cache,
+                                        loudness_target=args.loudness)
+    print(json.dumps(result))
+
+def cut_command(args):
+    from conversion import cut_video
+
+    apply_service_options(args)
+    cut_video(args.input, args.output, args.start, args.end, use_cache=not args.no_cache,
+              mode="smart" if args.smart else "copy")
+
+def chapters_command(args):
+    from segments import split_by_chapters
+
+    output_format = output_format_for(args.output, args.format)
+    output_files = split_by_chapters(args.input, output_format, args.output,
+                                     None if args.quiet else print_progress, args.processes, args.mode)
+    print(json.dumps(output_files))
+
+def probe_command(args):
+    from probe import probe_many
+
+    apply_service_options(args)
+    print(json.dumps(probe_many(args.inputs, use_cache=not args.no_cache), indent=2))
+
+def batch_command(args):
+    from batch import BatchJob, convert_batch
+
+    apply_service_options(args)
+    jobs = []
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for input_file in args.inputs:
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        output_dir = args.output_dir or os.path.dirname(input_file)
+        jobs.append(BatchJob(input_file, os.path.join(output_dir, f"{base_name}.{args.format}"), args.format,
+                             args.start, args.end, mode=args.mode, loudness_target=args.loudness))
+
+    def report(job):
+        status = "ok" if job.status == "done" else f"failed: {job.error}"
+        sys.stderr.write(f"{job.input_file}: {status}\n")
+
+    jobs = convert_batch(jobs, args.workers, args.retries, None, None if args.quiet else report, args.group_size)
+    return 0 if all(job.status == "done" for job in jobs) else 1
+
+def watch_command(args):
+    from watch import load_watch_config
+
+    daemon = load_watch_config(args.config)
+    apply_service_options(args)
+
+    def report(job):
+        status = "ok" if job.status == "done" else f"failed: {job.error}"
+        sys.stderr.write(f"{job.input_file}: {status}\n")
+
+    daemon.job_callback = None if args.quiet else report
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+def cache_command(args):
+    from output_cache import get_output_cache
+
+    cache = get_output_cache()
+    if args.clear:
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=2))
+
+def gui_command(args):
+    from PyQt5.QtWidgets import QApplication
+    from gui import MainWindow
+
+    app = QApplication(sys.argv[:1])
+    window = MainWindow()
+    window.show()
+    return app.exec_()
+
+def add_backend_argument(parser):
+    parser.add_argument("--backend", choices=["subprocess", "pyav"],
+                        help="run ffmpeg as a process per file (default) or in-process through PyAV")
+
+def add_service_arguments(parser, metrics=True):
+    add_backend_argument(parser)
+    parser.add_argument("--policy", help="JSON resource policy: ffmpeg threads, nice/ionice and a day/night schedule")
+    if metrics:
+        parser.add_argument("--metrics-port", type=int,
+                            help="serve per-format job metrics in Prometheus format on this local port")
+
+def add_loudness_argument(parser):
+    parser.add_argument("--loudness", type=float, metavar="LUFS",
+                        help="normalize to this integrated loudness (two-pass EBU R128), e.g. -16; always re-encodes")
+
+def add_range_arguments(parser, required=False):
+    parser.add_argument("--start", type=float, required=required, help="start time in seconds")
+    parser.add_argument("--end", type=float, required=required, help="end time in seconds")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="video-converter", description="Convert and cut video files with FFmpeg.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert", help="extract the audio track of a video")
+    convert.add_argument("input")
+    convert.add_argument("output")
+    convert.add_argument("-f", "--format", help="output format (defaults to the output file extension)")
+    convert.add_argument("--mode", choices=["auto", "copy", "transcode"], default="auto")
+    convert.add_argument("--chunks", type=int,
+                         help="decode this many parts of a long source in parallel (wav and flac output only; "
+                              "other formats are converted in a single pass)")
+    convert.add_argument("--trim-silence", action="store_true", help="drop silent lead-in and tail")
+    convert.add_argument("--cut-internal-silence", action="store_true", help="also drop long internal silences")
+    convert.add_argument("--silence-threshold", type=float, default=-50.0, help="silence level in dBFS")
+    convert.add_argument("--silence-min-duration", type=float, default=1.0, help="shortest silence to remove, in seconds")
+    convert.add_argument("--no-cache", action="store_true",
+                         help="always run ffmpeg, even for a repeat conversion, and do not store the output "
+                              "(on filesystems without reflink the cache keeps a second copy)")
+    convert.add_argument("-q", "--quiet", action="store_true")
+    add_loudness_argument(convert)
+    add_service_arguments(convert, metrics=False)
+    add_range_arguments(convert)
+    convert.set_defaults(func=convert_command)
+
+    cut = subparsers.add_parser("cut", help="cut a time range out of a video")
+    cut.add_argument("input")
+    cut.add_argument("output")
+    cut.add_argument("--no-cache", action="store_true",
+                     help="always run ffmpeg, even for a repeat cut, and do not store the output "
+                          "(on filesystems without reflink the cache keeps a second copy)")
+    cut.add_argument("--smart", action="store_true",
+                     help="frame-accurate cut: re-encode only the partial GOPs at each end and copy the rest")
+    add_backend_argument(cut)
+    add_range_arguments(cut, required=True)
+    cut.set_defaults(func=cut_command)
+
+    chapters = subparsers.add_parser("chapters", help="split the audio into one track per chapter")
+    chapters.add_argument("input")
+    chapters.add_argument("output", help="tracks are numbered after this name, e.g. book.mp3 gives book_01.mp3")
+    chapters.add_argument("-f", "--format", help="output format (defaults to the output file extension)")
+    chapters.add_argument("--mode", choices=["auto", "copy", "transcode"], default="auto")
+    chapters.add_argument("-j", "--processes", type=int,
+                          help="ffmpeg processes (defaults to one, or the CPU count for inputs over an hour)")
+    chapters.add_argument("-q", "--quiet", action="store_true")
+    chapters.set_defaults(func=chapters_command)
+
+    probe = subparsers.add_parser("probe", help="print media information as JSON")
+    probe.add_argument("inputs", nargs="+")
+    probe.add_argument("--no-cache", action="store_true")
+    add_backend_argument(probe)
+    probe.set_defaults(func=probe_command)
+
+    batch = subparsers.add_parser("batch", help="convert many videos concurrently")
+    batch.add_argument("inputs", nargs="+")
+    batch.add_argument("-f", "--format", default="mp3")
+    batch.add_argument("-o", "--output-dir")
+    batch.add_argument("-j", "--workers", type=int, help="parallel jobs (defaults to the CPU count)")
+    batch.add_argument("--retries", type=int, default=1)
+    batch.add_argument("--group-size", type=int, default=16,
+                       help="small inputs converted per ffmpeg command (1 converts each on its own)")
+    batch.add_argument("--mode", choices=["auto", "copy", "transcode"], default="auto")
+    batch.add_argument("-q", "--quiet", action="store_true")
+    add_loudness_argument(batch)
+    add_service_arguments(batch)
+    add_range_arguments(batch)
+    batch.set_defaults(func=batch_command)
+
+    watch = subparsers.add_parser("watch", help="convert videos as they appear in watched folders")
+    watch.add_argument("config", help="JSON file with the watched folders and their rules")
+    watch.add_argument("-q", "--quiet", action="store_true")
+    add_service_arguments(watch)
+    watch.set_defaults(func=watch_command)
+
+    cache = subparsers.add_parser("cache", help="show or clear the output cache (outputs are reflinked into it "
+                                                "where the filesystem supports it, otherwise copied)")
+    cache.add_argument("--clear", action="store_true")
+    cache.set_defaults(func=cache_command)
+
+    gui = subparsers.add_parser("gui", help="start the graphical interface")
+    gui.set_defaults(func=gui_command)
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # A time range needs both ends; the conversions would silently ignore a lone --start or --end
+    if (getattr(args, "start", None) is None) != (getattr(args, "end", None) is None):
+        parser.error("--start and --end must be given together")
+    try:
+        return args.func(args) or 0
+    except Exception as e:
+        sys.stderr.write(f"error: {e}\n")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
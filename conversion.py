@@ -1,73 +1,305 @@
 import os
-import subprocess
 import shutil
+import time
+
+from backends import get_backend, seek_args
+from estimator import record_conversion
+from keyframes import smart_cut
+from loudness import loudnorm_filter, measure_loudness
+from metrics import get_metrics_recorder, job_metrics
+from output_cache import cache_key, get_output_cache
+from probe import probe
+from progress import DEFAULT_PROGRESS_INTERVAL, discard, format_error, partial_path, run_ffmpeg
 
 def check_ffmpeg():
     return shutil.which("ffmpeg") is not None
 
-def convert_video_to_audio(input_file, output_file, output_format, progress_callback):
+def convert_video_to_audio(input_file, output_file, output_format, progress_callback=None, start_time=None, end_time=None,
+                           mode="auto", event_callback=None, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                           use_cache=True, control=None, loudness_target=None):
+    backend = get_backend()
+    backend.check()
+
+    key = None
+    if use_cache:
+        # ffmpeg picks the muxer from the output extension, so the container is part of the key
+        params = {"operation": "convert", "format": output_format, "mode": mode, "start": start_time, "end": end_time,
+                  "container": os.path.splitext(output_file)[1].lower()}
+        if loudness_target is not None:
+            params["loudness"] = loudness_target
+        key = cache_key(input_file, params)
+        cached = get_output_cache().fetch(key, output_file)
+        if cached is not None:
+            if progress_callback:
+                progress_callback(100)
+            return cached
+
+    probe_started = time.monotonic()
+    info = probe(input_file)
+    probe_time = time.monotonic() - probe_started
+    codec, mode = choose_audio_codec(info["audio_codec"], output_format, mode)
+    start_time, total_duration = _time_range(info["duration"], start_time, end_time)
+
+    audio_filter = None
+    if loudness_target is not None:
+        # Two-pass EBU R128: measure (or reuse a cached measurement), then normalize while encoding
+        codec, mode = choose_audio_codec(info["audio_codec"], output_format, "transcode")
+        if codec == "copy":
+            raise Exception(f"Loudness normalization needs an encoder, and {output_format} has none.")
+        measurement = measure_loudness(input_file, start_time, end_time, use_cache=use_cache, control=control)
+        audio_filter = loudnorm_filter(measurement, loudness_target, sample_rate=info["sample_rate"])
+
+    # Written under a temporary name and renamed on success, so a failed or cancelled job leaves no partial output
+    partial_file = partial_path(output_file)
+
+    try:
+        result = backend.convert_audio(input_file, partial_file, codec, start_time, total_duration, progress_callback,
+                                       event_callback, progress_interval, control, audio_filter)
+
+        if result.returncode != 0:
+            _record_metrics(input_file, output_file, output_format, mode, total_duration, probe_time, result,
+                            partial_file)
+            raise Exception(format_error("Conversion failed. Check if the input file is valid.", result))
+        os.replace(partial_file, output_file)
+    finally:
+        discard(partial_file)
+
+    record_conversion(output_format, mode, codec, total_duration, os.path.getsize(input_file), result.wall_time)
+    conversion = {"output_file": output_file, "mode": mode, "codec": codec, "wall_time": result.wall_time}
+    if key is not None:
+        get_output_cache().store(key, output_file, conversion)
+    # Attached after storing, so a later cache hit does not report this run's timings
+    conversion["metrics"] = _record_metrics(input_file, output_file, output_format, mode, total_duration, probe_time,
+                                            result)
+    return conversion
+
+def _record_metrics(input_file, output_file, output_format, mode, media_duration, probe_time, result,
+                    written_file=None):
+    metrics = job_metrics(input_file, output_file, output_format, mode, media_duration, probe_time, result,
+                          written_file)
+    try:
+        get_metrics_recorder().record(metrics)
+    except OSError:
+        # Metrics are best effort and must never fail a conversion
+        pass
+    return metrics
+
+def convert_to_formats(input_file, targets, progress_callback=None, start_time=None, end_time=None, mode="auto",
+                       event_callback=None, progress_interval=DEFAULT_PROGRESS_INTERVAL, control=None):
     if not check_ffmpeg():
         raise Exception("FFmpeg is not installed. Please install it using 'sudo apt-get install ffmpeg'.")
+    if not targets:
+        raise Exception("No output targets given.")
 
-    total_duration = get_video_duration(input_file)
-    
-    command = [
-        "ffmpeg",
-        "-i", input_file,
-        "-vn",
-        "-acodec", get_audio_codec(output_format),
-        "-y",  # Overwrite output file if it exists
-        output_file
-    ]
+    info = probe(input_file)
+    start_time, total_duration = _time_range(info["duration"], start_time, end_time)
 
-    process = subprocess.Popen(command, stderr=subprocess.PIPE, universal_newlines=True)
+    # One input and one decode, fanned out to an encoder per target
+    command = ["ffmpeg"] + seek_args(input_file, start_time, total_duration)
+    results = []
+    partial_files = []
+    for output_format, output_file in targets:
+        codec, target_mode = choose_audio_codec(info["audio_codec"], output_format, mode)
+        partial_files.append(partial_path(output_file))
+        command += ["-map", "0:a:0", "-acodec", codec, "-y", partial_files[-1]]
+        results.append({"output_file": output_file, "output_format": output_format, "mode": target_mode,
+                        "codec": codec, "success": False, "error": None})
 
-    for line in process.stderr:
-        if "time=" in line:
-            time = line.split("time=")[1].split()[0]
-            current_duration = time_to_seconds(time)
-            progress = int((current_duration / total_duration) * 100)
-            progress_callback(progress)
+    try:
+        result = run_ffmpeg(command, total_duration, progress_callback, event_callback, progress_interval, control)
 
-    process.wait()
+        for target, partial_file in zip(results, partial_files):
+            # A failed command may have stopped early and left truncated files, so only a clean exit counts
+            target["success"] = (result.returncode == 0 and os.path.exists(partial_file)
+                                 and os.path.getsize(partial_file) > 0)
+            if target["success"]:
+                os.replace(partial_file, target["output_file"])
+            else:
+                target["error"] = format_error(f"Could not write {target['output_file']}.", result)
+    finally:
+        for partial_file in partial_files:
+            discard(partial_file)
 
-    if process.returncode != 0:
-        raise Exception("Conversion failed. Check if the input file is valid.")
+    if not any(target["success"] for target in results):
+        raise Exception(format_error("Conversion failed. Check if the input file is valid.", result))
+    return results
 
-def cut_video(input_file, output_file, start_time, end_time):
+def convert_group(items, progress_callback=None, progress_interval=DEFAULT_PROGRESS_INTERVAL, use_cache=True,
+                  control=None):
+    # items are (input_file, output_file, output_format, start_time, end_time, mode) tuples converted by a single
+    # ffmpeg; progress_callback gets (index, percent) and the result list has one entry per item
     if not check_ffmpeg():
         raise Exception("FFmpeg is not installed. Please install it using 'sudo apt-get install ffmpeg'.")
 
-    command = [
-        "ffmpeg",
-        "-i", input_file,
-        "-ss", str(start_time),
-        "-to", str(end_time),
-        "-c", "copy",
-        "-y",  # Overwrite output file if it exists
-        output_file
-    ]
+    results = [None] * len(items)
+    members = []
+    inputs = []
+    outputs = []
+    for index, (input_file, output_file, output_format, start_time, end_time, mode) in enumerate(items):
+        key = None
+        if use_cache:
+            key = cache_key(input_file, {"operation": "convert", "format": output_format, "mode": mode,
+                                         "start": start_time, "end": end_time,
+                                         "container": os.path.splitext(output_file)[1].lower()})
+            cached = get_output_cache().fetch(key, output_file)
+            if cached is not None:
+                results[index] = dict(cached, success=True, error=None)
+                if progress_callback:
+                    progress_callback(index, 100)
+                continue
+
+        try:
+            probe_started = time.monotonic()
+            info = probe(input_file)
+            probe_time = time.monotonic() - probe_started
+            if info["audio_codec"] is None:
+                raise Exception(f"{input_file} has no audio stream.")
+            codec, item_mode = choose_audio_codec(info["audio_codec"], output_format, mode)
+            start, duration = _time_range(info["duration"], start_time, end_time)
+        except Exception as e:
+            # A file ffmpeg could not open would fail the whole command, so it is left out of it
+            results[index] = {"output_file": output_file, "success": False, "error": str(e)}
+            continue
+
+        partial_file = partial_path(output_file)
+        inputs += seek_args(input_file, start, duration)
+        outputs += ["-map", f"{len(members)}:a:0", "-acodec", codec, "-y", partial_file]
+        members.append((index, input_file, output_file, output_format, item_mode, codec, duration, probe_time, key,
+                        partial_file))
+
+    if not members:
+        return results
+
+    def on_event(event):
+        # Inputs are read side by side, so ffmpeg's position is roughly where every member is
+        for index, _, _, _, _, _, duration, _, _, _ in members:
+            percent = 100 if event.finished or duration <= 0 else min(100, int(event.out_time / duration * 100))
+            progress_callback(index, percent)
+
+    try:
+        result = run_ffmpeg(["ffmpeg"] + inputs + outputs, max(member[6] for member in members), None,
+                            on_event if progress_callback else None, progress_interval, control)
 
-    process = subprocess.run(command, stderr=subprocess.PIPE, universal_newlines=True)
+        total_duration = sum(member[6] for member in members)
+        for (index, input_file, output_file, output_format, mode, codec, duration, probe_time, key,
+             partial_file) in members:
+            # A failed command may have stopped early and left truncated files, so only a clean exit counts
+            if result.returncode == 0 and os.path.exists(partial_file) and os.path.getsize(partial_file) > 0:
+                os.replace(partial_file, output_file)
+                # The throughput model shares its rows with single conversions, so each member is credited with
+                # its share of the run by duration rather than the whole group's wall time
+                share = duration / total_duration if total_duration > 0 else 1 / len(members)
+                record_conversion(output_format, mode, codec, duration, os.path.getsize(input_file),
+                                  result.wall_time * share)
+                conversion = {"output_file": output_file, "mode": mode, "codec": codec, "wall_time": result.wall_time}
+                if key is not None:
+                    get_output_cache().store(key, output_file, conversion)
+                conversion["metrics"] = _record_metrics(input_file, output_file, output_format, mode, duration,
+                                                        probe_time, result)
+                results[index] = dict(conversion, success=True, error=None)
+            else:
+                _record_metrics(input_file, output_file, output_format, mode, duration, probe_time, result,
+                                partial_file)
+                results[index] = {"output_file": output_file, "success": False,
+                                  "error": format_error(f"Could not convert {input_file} as part of a group.", result)}
+    finally:
+        for member in members:
+            discard(member[-1])
+    return results
 
-    if process.returncode != 0:
-        raise Exception("Video cutting failed. Check if the input file is valid and the time range is correct.")
+def check_time_range(start_time, end_time):
+    # A range needs both ends; with only one, every path would otherwise quietly convert the whole file
+    if (start_time is None) != (end_time is None):
+        raise Exception("Invalid time range: give both a start and an end time, or neither.")
+
+def _time_range(total_duration, start_time=None, end_time=None):
+    check_time_range(start_time, end_time)
+    if start_time is None:
+        return None, total_duration
+
+    end_time = min(end_time, total_duration)
+    duration = end_time - start_time
+    if duration <= 0:
+        raise Exception("Invalid time range: the end time must be after the start time.")
+    return start_time, duration
+
+def cut_video(input_file, output_file, start_time, end_time, use_cache=True, control=None, mode="copy"):
+    backend = get_backend()
+    backend.check()
+
+    key = None
+    if use_cache:
+        # The container follows the output extension, so it is part of the key
+        key = cache_key(input_file, {"operation": "cut", "start": start_time, "end": end_time, "mode": mode,
+                                     "container": os.path.splitext(output_file)[1].lower()})
+        cached = get_output_cache().fetch(key, output_file)
+        if cached is not None:
+            return cached
+
+    if mode not in ("copy", "smart"):
+        raise Exception(f"Unknown cut mode: {mode}. Use copy or smart.")
+
+    partial_file = partial_path(output_file)
+    try:
+        # Smart cuts are frame-accurate; codecs without an edge encoder fall through to the plain copy
+        if mode == "smart" and smart_cut(input_file, partial_file, start_time, end_time, control):
+            os.replace(partial_file, output_file)
+            if key is not None:
+                get_output_cache().store(key, output_file, {"output_file": output_file, "mode": "smart"})
+            return {"output_file": output_file, "mode": "smart"}
+    finally:
+        discard(partial_file)
+
+    try:
+        result = backend.cut(input_file, partial_file, start_time, end_time, control)
+
+        if result.returncode != 0:
+            raise Exception(format_error("Video cutting failed. Check if the input file is valid and the time range is correct.", result))
+        os.replace(partial_file, output_file)
+    finally:
+        discard(partial_file)
+
+    if key is not None:
+        get_output_cache().store(key, output_file, {"output_file": output_file, "mode": "copy"})
+    return {"output_file": output_file, "mode": "copy"}
 
 def get_video_duration(input_file):
-    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", input_file]
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    return float(result.stdout)
+    return probe(input_file)["duration"]
 
 def time_to_seconds(time_str):
     h, m, s = time_str.split(':')
     return int(h) * 3600 + int(m) * 60 + float(s)
 
+# Encoder used for each supported output format
+AUDIO_CODECS = {
+    "mp3": "libmp3lame",
+    "wav": "pcm_s16le",
+    "ogg": "libvorbis",
+    "flac": "flac",
+    "aac": "aac",
+    "m4a": "aac",
+}
+
 def get_audio_codec(output_format):
-    codec_map = {
-        "mp3": "libmp3lame",
-        "wav": "pcm_s16le",
-        "ogg": "libvorbis",
-        "flac": "flac",
-        "aac": "aac"
-    }
-    return codec_map.get(output_format, "copy")
\ No newline at end of file
+    return AUDIO_CODECS.get(output_format, "copy")
+
+# Source codecs that can be stream-copied into each output format's container as-is
+PASSTHROUGH_CODECS = {
+    "mp3": {"mp3"},
+    "wav": {"pcm_s16le"},
+    "ogg": {"vorbis"},
+    "flac": {"flac"},
+    "aac": {"aac"},
+    "m4a": {"aac", "alac"},
+}
+
+def can_passthrough(source_codec, output_format):
+    return source_codec in PASSTHROUGH_CODECS.get(output_format, ())
+
+def choose_audio_codec(source_codec, output_format, mode="auto"):
+    if mode not in ("auto", "copy", "transcode"):
+        raise Exception(f"Unknown conversion mode: {mode}")
+
+    if mode == "copy" or (mode == "auto" and can_passthrough(source_codec, output_format)):
+        return "copy", "copy"
+    return get_audio_codec(output_format), "transcode"
\ No newline at end of file
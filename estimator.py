@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import statistics
+import threading
+import time
+
+from utils import get_cache_dir
+
+MAX_SAMPLES = 200
+MIN_SAMPLES = 3
+
+# Realtime factors (seconds of media per second of wall time) used before any job has been recorded
+DEFAULT_REALTIME_FACTORS = {
+    "copy": 200.0,
+    "transcode": 30.0,
+}
+
+class ThroughputModel:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), "throughput.sqlite")
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "output_format TEXT, mode TEXT, codec TEXT, duration REAL, input_bytes INTEGER, "
+            "wall_time REAL, realtime_factor REAL, recorded_at REAL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS samples_key ON samples (output_format, mode, recorded_at)")
+        self._connection.commit()
+
+    def record(self, output_format, mode, codec, duration, input_bytes, wall_time):
+        if duration <= 0 or wall_time <= 0:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (output_format, mode, codec, duration, input_bytes, wall_time, duration / wall_time, time.time()))
+            # Keep only the most recent samples per format and mode so the model follows hardware changes
+            self._connection.execute(
+                "DELETE FROM samples WHERE output_format = ? AND mode = ? AND rowid NOT IN ("
+                "SELECT rowid FROM samples WHERE output_format = ? AND mode = ? ORDER BY recorded_at DESC LIMIT ?)",
+                (output_format, mode, output_format, mode, MAX_SAMPLES))
+            self._connection.commit()
+
+    def realtime_factors(self, output_format, mode):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT realtime_factor FROM samples WHERE output_format = ? AND mode = ?",
+                (output_format, mode)).fetchall()
+        return [row[0] for row in rows]
+
+    def predict(self, duration, output_format, mode="transcode"):
+        factors = self.realtime_factors(output_format, mode)
+        if len(factors) < MIN_SAMPLES:
+            factor = DEFAULT_REALTIME_FACTORS.get(mode, DEFAULT_REALTIME_FACTORS["transcode"])
+            # Without history the bounds are deliberately wide
+            return duration / factor, duration / (factor * 4), duration / (factor / 4)
+
+        factors.sort()
+        deciles = statistics.quantiles(factors, n=10)
+        median = statistics.median(factors)
+        # A high realtime factor means a short job, so the slow decile gives the upper bound
+        return duration / median, duration / deciles[-1], duration / deciles[0]
+
+_default_model = None
+_default_model_lock = threading.Lock()
+
+def get_throughput_model():
+    global _default_model
+    with _default_model_lock:
+        if _default_model is None:
+            _default_model = ThroughputModel()
+        return _default_model
+
+def record_conversion(output_format, mode, codec, duration, input_bytes, wall_time):
+    try:
+        get_throughput_model().record(output_format, mode, codec, duration, input_bytes, wall_time)
+    except sqlite3.Error:
+        # Recording is best effort and must never fail a finished conversion
+        pass
+
+def predict_conversion_time(duration, output_format, mode="transcode"):
+    return get_throughput_model().predict(duration, output_format, mode)
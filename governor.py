@@ -0,0 +1,192 @@
+import ctypes
+import ctypes.util
+import datetime
+import json
+import os
+import platform
+import threading
+
+# How often a job waiting for its thread budget re-reads the load average and disk queue
+RECHECK_INTERVAL = 2.0
+
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314}
+
+class Profile:
+    # One row of the schedule; None means "no limit" for every cap
+    def __init__(self, start="00:00", end="00:00", threads_per_job=None, max_threads=None, max_jobs=None,
+                 nice=None, ionice=None, ionice_level=4, max_load_per_cpu=None, max_disk_queue=None):
+        self.start = _parse_clock(start)
+        self.end = _parse_clock(end)
+        self.threads_per_job = threads_per_job
+        self.max_threads = max_threads
+        self.max_jobs = max_jobs
+        self.nice = nice
+        self.ionice = ionice
+        self.ionice_level = ionice_level
+        self.max_load_per_cpu = max_load_per_cpu
+        self.max_disk_queue = max_disk_queue
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("start", "00:00"), data.get("end", "00:00"), data.get("threads_per_job"),
+                   data.get("max_threads"), data.get("max_jobs"), data.get("nice"), data.get("ionice"),
+                   data.get("ionice_level", 4), data.get("max_load_per_cpu"), data.get("max_disk_queue"))
+
+    def active_at(self, moment):
+        # start == end covers the whole day; a window like 20:00-08:00 wraps past midnight
+        if self.start == self.end:
+            return True
+        if self.start < self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+def _parse_clock(value):
+    hours, minutes = value.split(":")
+    return datetime.time(int(hours), int(minutes))
+
+def load_average_per_cpu():
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return 0.0
+
+def disk_queue_depth(devices=None):
+    # Field 12 of /proc/diskstats is the number of I/Os currently in flight
+    depth = 0
+    try:
+        with open("/proc/diskstats") as f:
+            lines = f.readlines()
+    except OSError:
+        return 0
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 12:
+            continue
+        name = fields[2]
+        if devices:
+            if name not in devices:
+                continue
+        # Without a device list, count whole disks only so partitions are not counted twice
+        elif not os.path.exists(f"/sys/block/{name}/device"):
+            continue
+        depth += int(fields[11])
+    return depth
+
+def limit_threads(command, threads):
+    # Every command this project builds ends each output with "-y <file>"; -threads goes in front of each
+    # output for the encoders and in front of each -i for the decoders
+    limited = [command[0]]
+    for arg in command[1:]:
+        if arg in ("-i", "-y"):
+            limited += ["-threads", str(threads)]
+        limited.append(arg)
+    return limited
+
+class Governor:
+    def __init__(self, profiles=None, devices=None, recheck_interval=RECHECK_INTERVAL):
+        self.profiles = profiles or [Profile()]
+        self.devices = devices
+        self.recheck_interval = recheck_interval
+        self._condition = threading.Condition()
+        self._threads_in_use = 0
+        self._jobs = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([Profile.from_dict(profile) for profile in data.get("schedule", [data])], data.get("devices"),
+                   data.get("recheck_interval", RECHECK_INTERVAL))
+
+    def profile(self, now=None):
+        moment = (now or datetime.datetime.now()).time()
+        for profile in self.profiles:
+            if profile.active_at(moment):
+                return profile
+        return Profile()
+
+    def _overloaded(self, profile):
+        if profile.max_load_per_cpu is not None and load_average_per_cpu() > profile.max_load_per_cpu:
+            return True
+        if profile.max_disk_queue is not None and disk_queue_depth(self.devices) > profile.max_disk_queue:
+            return True
+        return False
+
+    def _admits(self, profile, threads):
+        # A job is always admitted when nothing else runs, so a tight limit can slow work but never stall it
+        if self._jobs == 0:
+            return True
+        if profile.max_jobs is not None and self._jobs >= profile.max_jobs:
+            return False
+        if profile.max_threads is not None and self._threads_in_use + threads > profile.max_threads:
+            return False
+        return not self._overloaded(profile)
+
+    def acquire(self, control=None):
+        with self._condition:
+            while True:
+                if control is not None:
+                    control.check()
+                profile = self.profile()
+                threads = profile.threads_per_job or 0
+                if profile.max_threads is not None:
+                    # Without a per-job figure each job gets one thread, which is all the audio encoders use;
+                    # handing each job the whole budget would let only one run at a time
+                    threads = min(threads or 1, profile.max_threads)
+                if self._admits(profile, threads):
+                    self._threads_in_use += threads
+                    self._jobs += 1
+                    return profile, threads
+                self._condition.wait(self.recheck_interval)
+
+    def release(self, threads):
+        with self._condition:
+            self._threads_in_use -= threads
+            self._jobs -= 1
+            self._condition.notify_all()
+
+    def prepare(self, command, threads):
+        return limit_threads(command, threads) if threads else command
+
+    def apply(self, pid, profile):
+        # Applied right after spawning, before ffmpeg starts its worker threads, which inherit both settings
+        if profile.nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, profile.nice)
+            except OSError:
+                pass
+        if profile.ionice in IOPRIO_CLASSES:
+            set_io_priority(pid, IOPRIO_CLASSES[profile.ionice], profile.ionice_level)
+
+def set_io_priority(pid, io_class, level=4):
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if number is None:
+        return False
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    value = (io_class << IOPRIO_CLASS_SHIFT) | (0 if io_class == IOPRIO_CLASSES["idle"] else level)
+    return libc.syscall(number, IOPRIO_WHO_PROCESS, pid, value) == 0
+
+def load_policy(path):
+    with open(path) as f:
+        return Governor.from_dict(json.load(f))
+
+_governor = None
+_governor_loaded = False
+_governor_lock = threading.Lock()
+
+def set_governor(governor):
+    global _governor, _governor_loaded
+    with _governor_lock:
+        _governor = governor
+        _governor_loaded = True
+
+def get_governor():
+    # Unrestricted unless a policy is set explicitly or named by VIDEO_CONVERTER_POLICY
+    global _governor, _governor_loaded
+    with _governor_lock:
+        if not _governor_loaded:
+            path = os.environ.get("VIDEO_CONVERTER_POLICY")
+            _governor = load_policy(path) if path else None
+            _governor_loaded = True
+        return _governor
@@ -2,45 +2,205 @@ import os
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLabel, QLineEdit, QComboBox, 
                              QFileDialog, QProgressBar, QMessageBox, QSlider,
-                             QSpinBox)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QUrl
-from PyQt5.QtGui import QPixmap
+                             QSpinBox, QCheckBox, QGridLayout, QStyle)
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QUrl, QLineF, QPoint
+from PyQt5.QtGui import QPixmap, QPainter, QColor
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from conversion import convert_video_to_audio, cut_video, get_video_duration
+from conversion import convert_to_formats, convert_video_to_audio, get_video_duration
+from batch import BatchJob, BatchQueue, default_worker_count
+from progress import JobCancelled, JobControl
+from probe import probe
+from segments import chapter_processes, chapter_segments, extract_segments, load_segments
+from waveform import load_waveform
+from silence import detect_silence, keep_ranges
+from thumbnails import ThumbnailStrip
+
+# How long closing the window waits for cancelled work to stop
+SHUTDOWN_TIMEOUT_MS = 5000
+
+def format_progress_details(event):
+    details = f"{event.speed:.1f}x"
+    if event.eta is not None:
+        minutes, seconds = divmod(int(event.eta), 60)
+        details += f", {minutes}:{seconds:02d} remaining"
+    return f"Converting... ({details})"
 
 class ConversionThread(QThread):
     progress = pyqtSignal(int)
+    details = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, input_file, output_file, output_format, start_time, end_time):
+    def __init__(self, input_file, output_file, output_format, start_time, end_time, mode="auto", extra_formats=()):
         super().__init__()
         self.input_file = input_file
         self.output_file = output_file
         self.output_format = output_format
         self.start_time = start_time
         self.end_time = end_time
+        self.mode = mode
+        self.extra_formats = list(extra_formats)
+        self.control = JobControl()
 
     def run(self):
         try:
-            if self.start_time is not None and self.end_time is not None:
-                # Cut the video first
-                temp_cut_file = f"temp_cut_{os.path.basename(self.input_file)}"
-                cut_video(self.input_file, temp_cut_file, self.start_time, self.end_time)
-                
-                # Convert the cut video to audio
-                convert_video_to_audio(temp_cut_file, self.output_file, self.output_format, self.progress.emit)
-                
-                # Remove the temporary cut video file
-                os.remove(temp_cut_file)
+            if self.extra_formats:
+                self.run_fan_out()
+                return
+            result = convert_video_to_audio(self.input_file, self.output_file, self.output_format, self.progress.emit,
+                                            self.start_time, self.end_time, self.mode,
+                                            lambda event: self.details.emit(format_progress_details(event)),
+                                            control=self.control)
+            if result["mode"] == "copy":
+                self.finished.emit(True, "Conversion completed successfully! (audio stream copied without re-encoding)")
             else:
-                # Convert the entire video to audio
-                convert_video_to_audio(self.input_file, self.output_file, self.output_format, self.progress.emit)
-            
-            self.finished.emit(True, "Conversion completed successfully!")
+                self.finished.emit(True, "Conversion completed successfully!")
+        except JobCancelled:
+            self.finished.emit(False, "Conversion cancelled.")
         except Exception as e:
             self.finished.emit(False, str(e))
 
+    def run_fan_out(self):
+        base_name = os.path.splitext(self.output_file)[0]
+        targets = [(self.output_format, self.output_file)]
+        targets += [(fmt, f"{base_name}.{fmt}") for fmt in self.extra_formats if fmt != self.output_format]
+        results = convert_to_formats(self.input_file, targets, self.progress.emit, self.start_time, self.end_time,
+                                     self.mode, lambda event: self.details.emit(format_progress_details(event)),
+                                     control=self.control)
+        failed = [os.path.basename(target["output_file"]) for target in results if not target["success"]]
+        if failed:
+            self.finished.emit(False, f"Some outputs could not be written: {', '.join(failed)}")
+        else:
+            self.finished.emit(True, f"Conversion to {len(results)} formats completed successfully!")
+
+class SegmentThread(QThread):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(bool, str)
+
+    def __init__(self, input_file, segments, output_format, output_file, concat, mode="auto", processes=None):
+        super().__init__()
+        self.input_file = input_file
+        self.segments = segments
+        self.output_format = output_format
+        self.output_file = output_file
+        self.concat = concat
+        self.mode = mode
+        self.processes = processes or default_worker_count()
+        self.control = JobControl()
+
+    def run(self):
+        try:
+            output_files = extract_segments(self.input_file, self.segments, self.output_format, self.output_file,
+                                            self.progress.emit, self.concat, self.processes, self.mode,
+                                            control=self.control)
+            if self.concat:
+                self.finished.emit(True, f"Joined {len(self.segments)} segments into {os.path.basename(output_files[0])}.")
+            else:
+                self.finished.emit(True, f"Extracted {len(output_files)} segments successfully!")
+        except JobCancelled:
+            self.finished.emit(False, "Segment extraction cancelled.")
+        except Exception as e:
+            self.finished.emit(False, str(e))
+
+class BatchThread(QThread):
+    progress = pyqtSignal(int)
+    job_finished = pyqtSignal(str, bool, str)
+    finished = pyqtSignal(bool, str)
+
+    def __init__(self, jobs, workers):
+        super().__init__()
+        self.jobs = jobs
+        self.queue = BatchQueue(workers, progress_callback=self.progress.emit,
+                                job_callback=lambda job: self.job_finished.emit(job.input_file, job.status == "done",
+                                                                                job.error or job.status))
+
+    def run(self):
+        for job in self.jobs:
+            self.queue.submit(job)
+        jobs = self.queue.run()
+        failed = [job for job in jobs if job.status != "done"]
+        cancelled = [job for job in jobs if job.status == "cancelled"]
+        if cancelled:
+            self.finished.emit(False, f"Batch cancelled; {len(jobs) - len(failed)} of {len(jobs)} conversions completed.")
+        elif failed:
+            self.finished.emit(False, f"{len(failed)} of {len(jobs)} conversions failed.")
+        else:
+            self.finished.emit(True, f"All {len(jobs)} conversions completed successfully!")
+
+class WaveformThread(QThread):
+    loaded = pyqtSignal(str, object)
+
+    def __init__(self, input_file):
+        super().__init__()
+        self.input_file = input_file
+
+    def run(self):
+        try:
+            self.loaded.emit(self.input_file, load_waveform(self.input_file, stop=self.isInterruptionRequested))
+        except Exception:
+            self.loaded.emit(self.input_file, None)
+
+class WaveformWidget(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.waveform = None
+        self.setMinimumHeight(40)
+
+    def set_waveform(self, waveform):
+        self.waveform = waveform
+        self.update()
+
+    def paintEvent(self, event):
+        if self.waveform is None:
+            return
+        mins, maxs = self.waveform.peaks(self.width())
+        if not len(mins):
+            return
+        middle = self.height() / 2
+        scale = middle / 32768
+        step = self.width() / len(mins)
+        lines = [QLineF(i * step, middle - high * scale, i * step, middle - low * scale)
+                 for i, (low, high) in enumerate(zip(mins.tolist(), maxs.tolist()))]
+        painter = QPainter(self)
+        painter.setPen(QColor(120, 160, 220))
+        painter.drawLines(lines)
+
+class ThumbnailThread(QThread):
+    def __init__(self, strip):
+        super().__init__()
+        self.strip = strip
+
+    def run(self):
+        try:
+            self.strip.extract(self.isInterruptionRequested)
+        except Exception:
+            # Scrubbing just goes without previews
+            pass
+
+class ScrubSlider(QSlider):
+    # Reports the position under the mouse while hovering, in the same units as sliderMoved
+    hovered = pyqtSignal(int)
+    left = pyqtSignal()
+
+    def __init__(self, orientation):
+        super().__init__(orientation)
+        self.setMouseTracking(True)
+
+    def value_at(self, x):
+        return QStyle.sliderValueFromPosition(self.minimum(), self.maximum(), x, self.width())
+
+    def x_of(self, value):
+        return QStyle.sliderPositionFromValue(self.minimum(), self.maximum(), value, self.width())
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if not self.isSliderDown():
+            self.hovered.emit(self.value_at(event.x()))
+
+    def leaveEvent(self, event):
+        super().leaveEvent(event)
+        self.left.emit()
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -76,9 +236,25 @@ class MainWindow(QMainWindow):
         self.play_pause_button.clicked.connect(self.play_pause_video)
         controls_layout.addWidget(self.play_pause_button)
 
-        self.video_slider = QSlider(Qt.Horizontal)
-        self.video_slider.sliderMoved.connect(self.set_video_position)
-        controls_layout.addWidget(self.video_slider)
+        # The waveform overview is drawn behind the slider in the same grid cell
+        timeline_layout = QGridLayout()
+        self.waveform_widget = WaveformWidget()
+        self.waveform_threads = []
+        self.active_thread = None
+        self.cancel_requested = False
+        timeline_layout.addWidget(self.waveform_widget, 0, 0)
+        # Dragging only previews from the thumbnail strip; the player seeks once, when the drag ends
+        self.video_slider = ScrubSlider(Qt.Horizontal)
+        self.video_slider.sliderMoved.connect(self.show_preview)
+        self.video_slider.hovered.connect(self.show_preview)
+        self.video_slider.left.connect(self.hide_preview)
+        self.video_slider.sliderReleased.connect(self.seek_to_slider)
+        timeline_layout.addWidget(self.video_slider, 0, 0)
+        self.thumbnail_strip = None
+        self.thumbnail_threads = []
+        self.preview_label = QLabel(self, Qt.ToolTip)
+        self.preview_label.hide()
+        controls_layout.addLayout(timeline_layout)
 
         layout.addLayout(controls_layout)
 
@@ -94,16 +270,48 @@ class MainWindow(QMainWindow):
         self.end_time_spin.setRange(0, 9999)
         cut_layout.addWidget(self.end_time_spin)
 
+        self.trim_silence_button = QPushButton("Trim Silence")
+        self.trim_silence_button.clicked.connect(self.trim_silence)
+        cut_layout.addWidget(self.trim_silence_button)
+
+        self.segments_button = QPushButton("Extract Segments...")
+        self.segments_button.clicked.connect(self.start_segment_extraction)
+        cut_layout.addWidget(self.segments_button)
+
+        self.chapters_button = QPushButton("Split by Chapters")
+        self.chapters_button.clicked.connect(self.start_chapter_split)
+        cut_layout.addWidget(self.chapters_button)
+
+        self.join_segments_check = QCheckBox("Join Segments")
+        cut_layout.addWidget(self.join_segments_check)
+
         layout.addLayout(cut_layout)
 
         # Output format selection
         format_layout = QHBoxLayout()
         self.format_combo = QComboBox()
-        self.format_combo.addItems(["mp3", "wav", "ogg", "flac", "aac"])
+        self.format_combo.addItems(["mp3", "wav", "ogg", "flac", "aac", "m4a"])
         format_layout.addWidget(QLabel("Output Format:"))
         format_layout.addWidget(self.format_combo)
+
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItem("Copy audio when possible", "auto")
+        self.mode_combo.addItem("Always re-encode", "transcode")
+        self.mode_combo.addItem("Always copy audio", "copy")
+        format_layout.addWidget(QLabel("Audio:"))
+        format_layout.addWidget(self.mode_combo)
         layout.addLayout(format_layout)
 
+        # Extra formats produced from the same decode
+        extra_layout = QHBoxLayout()
+        extra_layout.addWidget(QLabel("Also Save As:"))
+        self.extra_format_checks = {}
+        for fmt in ["mp3", "wav", "ogg", "flac", "aac", "m4a"]:
+            check = QCheckBox(fmt)
+            self.extra_format_checks[fmt] = check
+            extra_layout.addWidget(check)
+        layout.addLayout(extra_layout)
+
         # Output file selection
         output_layout = QHBoxLayout()
         self.output_file_edit = QLineEdit()
@@ -114,10 +322,32 @@ class MainWindow(QMainWindow):
         output_layout.addWidget(output_browse_button)
         layout.addLayout(output_layout)
 
-        # Convert button
+        # Convert buttons
+        convert_layout = QHBoxLayout()
         self.convert_button = QPushButton("Convert")
         self.convert_button.clicked.connect(self.start_conversion)
-        layout.addWidget(self.convert_button)
+        convert_layout.addWidget(self.convert_button)
+
+        self.batch_button = QPushButton("Convert Multiple...")
+        self.batch_button.clicked.connect(self.start_batch_conversion)
+        convert_layout.addWidget(self.batch_button)
+
+        self.pause_button = QPushButton("Pause")
+        self.pause_button.setEnabled(False)
+        self.pause_button.clicked.connect(self.toggle_pause)
+        convert_layout.addWidget(self.pause_button)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_conversion)
+        convert_layout.addWidget(self.cancel_button)
+
+        convert_layout.addWidget(QLabel("Parallel Jobs:"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 256)
+        self.workers_spin.setValue(default_worker_count())
+        convert_layout.addWidget(self.workers_spin)
+        layout.addLayout(convert_layout)
 
         # Progress bar
         self.progress_bar = QProgressBar()
@@ -143,10 +373,50 @@ class MainWindow(QMainWindow):
     def load_video(self, filename):
         self.media_player.setMedia(QMediaContent(QUrl.fromLocalFile(filename)))
         self.play_pause_button.setText("Play")
+
+        # Earlier threads stay referenced until they finish, since a running QThread must not be destroyed
+        for previous in self.waveform_threads:
+            previous.requestInterruption()
+        self.waveform_widget.set_waveform(None)
+        thread = WaveformThread(filename)
+        thread.loaded.connect(self.waveform_loaded)
+        thread.finished.connect(lambda thread=thread: self.waveform_threads.remove(thread))
+        self.waveform_threads.append(thread)
+        thread.start()
         self.video_duration = get_video_duration(filename)
         self.end_time_spin.setRange(0, int(self.video_duration))
         self.end_time_spin.setValue(int(self.video_duration))
 
+        for previous in self.thumbnail_threads:
+            previous.requestInterruption()
+        self.hide_preview()
+        self.thumbnail_strip = ThumbnailStrip(filename, self.video_duration)
+        thumbnail_thread = ThumbnailThread(self.thumbnail_strip)
+        thumbnail_thread.finished.connect(
+            lambda thread=thumbnail_thread: self.thumbnail_threads.remove(thread))
+        self.thumbnail_threads.append(thumbnail_thread)
+        thumbnail_thread.start()
+
+    def waveform_loaded(self, filename, waveform):
+        # Ignore results for a file that has since been replaced
+        if filename == self.input_file_edit.text():
+            self.waveform_widget.set_waveform(waveform)
+
+    def trim_silence(self):
+        waveform = self.waveform_widget.waveform
+        if waveform is None:
+            QMessageBox.information(self, "Trim Silence", "The audio is still being analyzed. Please try again shortly.")
+            return
+        silences = detect_silence(waveform.rms_db, waveform.seconds_per_rms_window)
+        ranges = keep_ranges(silences, waveform.duration)
+        if not ranges:
+            QMessageBox.information(self, "Trim Silence", "The audio is silent throughout.")
+            return
+        start, end = ranges[0]
+        self.start_time_spin.setValue(int(start))
+        self.end_time_spin.setValue(int(end + 0.999))
+        self.status_label.setText(f"Trimmed {start:.1f}s of lead-in and {waveform.duration - end:.1f}s of tail silence.")
+
     def play_pause_video(self):
         if self.media_player.state() == QMediaPlayer.PlayingState:
             self.media_player.pause()
@@ -158,11 +428,34 @@ class MainWindow(QMainWindow):
     def set_video_position(self, position):
         self.media_player.setPosition(position)
 
+    def seek_to_slider(self):
+        self.hide_preview()
+        self.set_video_position(self.video_slider.value())
+
+    def show_preview(self, position):
+        data = self.thumbnail_strip.nearest(position / 1000) if self.thumbnail_strip is not None else None
+        if data is None:
+            self.preview_label.hide()
+            return
+        pixmap = QPixmap()
+        pixmap.loadFromData(data)
+        self.preview_label.setPixmap(pixmap)
+        self.preview_label.resize(pixmap.size())
+        x = self.video_slider.x_of(position) - pixmap.width() // 2
+        self.preview_label.move(self.video_slider.mapToGlobal(QPoint(x, -pixmap.height() - 4)))
+        self.preview_label.show()
+
+    def hide_preview(self):
+        if not self.video_slider.isSliderDown():
+            self.preview_label.hide()
+
     def update_duration(self, duration):
         self.video_slider.setRange(0, duration)
 
     def update_position(self, position):
-        self.video_slider.setValue(position)
+        # Playback would otherwise pull the handle out from under a drag in progress
+        if not self.video_slider.isSliderDown():
+            self.video_slider.setValue(position)
 
     def browse_output_file(self):
         file_name, _ = QFileDialog.getSaveFileName(self, "Save Audio File", "", f"Audio Files (*.{self.format_combo.currentText()});;All Files (*)")
@@ -205,20 +498,160 @@ class MainWindow(QMainWindow):
                 self.output_file_edit.setText(output_file)
 
         self.convert_button.setEnabled(False)
+        self.batch_button.setEnabled(False)
+        self.segments_button.setEnabled(False)
+        self.chapters_button.setEnabled(False)
         self.progress_bar.setValue(0)
         self.status_label.setText("Converting...")
 
-        self.conversion_thread = ConversionThread(input_file, output_file, output_format, start_time, end_time)
+        extra_formats = [fmt for fmt, check in self.extra_format_checks.items() if check.isChecked()]
+        self.conversion_thread = ConversionThread(input_file, output_file, output_format, start_time, end_time,
+                                                  self.mode_combo.currentData(), extra_formats)
         self.conversion_thread.progress.connect(self.update_progress)
+        self.conversion_thread.details.connect(self.status_label.setText)
         self.conversion_thread.finished.connect(self.conversion_finished)
         self.conversion_thread.start()
+        self.set_active_thread(self.conversion_thread)
+
+    def start_segment_extraction(self):
+        input_file = self.input_file_edit.text()
+        output_file = self.output_file_edit.text()
+        if not input_file or not output_file:
+            QMessageBox.warning(self, "Error", "Please select input and output files.")
+            return
+
+        segments_file, _ = QFileDialog.getOpenFileName(self, "Select Segments File", "", "Segment Lists (*.csv *.json);;All Files (*)")
+        if not segments_file:
+            return
+        try:
+            segments = load_segments(segments_file)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Could not read segments: {e}")
+            return
+
+        self.start_segment_thread(input_file, segments, output_file, self.join_segments_check.isChecked())
+
+    def start_chapter_split(self):
+        input_file = self.input_file_edit.text()
+        output_file = self.output_file_edit.text()
+        if not input_file or not output_file:
+            QMessageBox.warning(self, "Error", "Please select input and output files.")
+            return
+        try:
+            info = probe(input_file)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        segments = chapter_segments(info)
+        if not segments:
+            QMessageBox.information(self, "Split by Chapters", "The input file has no chapters.")
+            return
+        # All tracks come out of a single decode, unless the input is long enough to be worth splitting up
+        self.start_segment_thread(input_file, segments, output_file, False, chapter_processes(info))
+
+    def start_segment_thread(self, input_file, segments, output_file, concat, processes=None):
+        self.convert_button.setEnabled(False)
+        self.batch_button.setEnabled(False)
+        self.segments_button.setEnabled(False)
+        self.chapters_button.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.status_label.setText(f"Extracting {len(segments)} segments...")
+
+        self.segment_thread = SegmentThread(input_file, segments, self.format_combo.currentText(), output_file,
+                                            concat, self.mode_combo.currentData(), processes)
+        self.segment_thread.progress.connect(self.update_progress)
+        self.segment_thread.finished.connect(self.conversion_finished)
+        self.segment_thread.start()
+        self.set_active_thread(self.segment_thread)
+
+    def start_batch_conversion(self):
+        file_names, _ = QFileDialog.getOpenFileNames(self, "Select Video Files", "", "Video Files (*.mp4 *.avi *.mkv *.flv *.mov);;All Files (*)")
+        if not file_names:
+            return
+
+        output_format = self.format_combo.currentText()
+        jobs = []
+        for input_file in file_names:
+            output_file = self.get_unique_filename(f"{os.path.splitext(input_file)[0]}.{output_format}")
+            jobs.append(BatchJob(input_file, output_file, output_format, mode=self.mode_combo.currentData()))
+
+        self.convert_button.setEnabled(False)
+        self.batch_button.setEnabled(False)
+        self.segments_button.setEnabled(False)
+        self.chapters_button.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.status_label.setText(f"Converting {len(jobs)} files...")
+
+        self.batch_thread = BatchThread(jobs, self.workers_spin.value())
+        self.batch_thread.progress.connect(self.update_progress)
+        self.batch_thread.job_finished.connect(self.batch_job_finished)
+        self.batch_thread.finished.connect(self.conversion_finished)
+        self.batch_thread.start()
+        self.set_active_thread(self.batch_thread)
+
+    def batch_job_finished(self, input_file, success, error):
+        name = os.path.basename(input_file)
+        self.status_label.setText(f"Finished {name}" if success else f"Failed {name}: {error}")
+
+    def set_active_thread(self, thread):
+        self.active_thread = thread
+        self.cancel_requested = False
+        self.pause_button.setText("Pause")
+        self.pause_button.setEnabled(True)
+        self.cancel_button.setEnabled(True)
+
+    def toggle_pause(self):
+        thread = self.active_thread
+        if thread is None:
+            return
+        if self.pause_button.text() == "Pause":
+            if isinstance(thread, BatchThread):
+                thread.queue.pause()
+            else:
+                thread.control.pause()
+            self.pause_button.setText("Resume")
+            self.status_label.setText("Paused.")
+        else:
+            if isinstance(thread, BatchThread):
+                thread.queue.resume()
+            else:
+                thread.control.resume()
+            self.pause_button.setText("Pause")
+            self.status_label.setText("Resuming...")
+
+    def cancel_active_thread(self):
+        thread = self.active_thread
+        if thread is None:
+            return
+        self.cancel_requested = True
+        if isinstance(thread, BatchThread):
+            thread.queue.cancel()
+        else:
+            thread.control.cancel()
+
+    def cancel_conversion(self):
+        self.cancel_active_thread()
+        self.cancel_button.setEnabled(False)
+        self.pause_button.setEnabled(False)
+        self.status_label.setText("Cancelling...")
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
 
     def conversion_finished(self, success, message):
+        cancelled = self.cancel_requested
+        self.active_thread = None
+        self.cancel_requested = False
         self.convert_button.setEnabled(True)
+        self.batch_button.setEnabled(True)
+        self.segments_button.setEnabled(True)
+        self.chapters_button.setEnabled(True)
+        self.pause_button.setEnabled(False)
+        self.pause_button.setText("Pause")
+        self.cancel_button.setEnabled(False)
         self.status_label.setText(message)
+        if cancelled:
+            return
         if success:
             QMessageBox.information(self, "Success", message)
         else:
@@ -226,4 +659,14 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         self.media_player.stop()
+        background_threads = self.waveform_threads + self.thumbnail_threads
+        for thread in background_threads:
+            thread.requestInterruption()
+        # Stop running ffmpeg processes rather than leaving them behind, but never hang the window indefinitely
+        thread = self.active_thread
+        if thread is not None:
+            self.cancel_active_thread()
+            thread.wait(SHUTDOWN_TIMEOUT_MS)
+        for thread in background_threads:
+            thread.wait(SHUTDOWN_TIMEOUT_MS)
         event.accept()
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+
+from probe import ProbeCache
+from progress import format_error, run_ffmpeg
+from utils import get_cache_dir
+
+# Re-encoders for the partial GOPs at the edges of a smart cut; other codecs fall back to a keyframe-aligned copy
+EDGE_ENCODERS = {
+    "h264": ["-c:v", "libx264", "-preset", "fast", "-crf", "16"],
+    "hevc": ["-c:v", "libx265", "-preset", "fast", "-crf", "18"],
+    "mpeg4": ["-c:v", "mpeg4", "-q:v", "2"],
+    "mpeg2video": ["-c:v", "mpeg2video", "-q:v", "2"],
+}
+# MPEG-TS keeps parameter sets in-band, so re-encoded and copied parts can be joined
+PART_CONTAINER = "ts"
+# Edges shorter than this are not worth a separate encode and are snapped to the keyframe
+MIN_EDGE_DURATION = 0.001
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+def get_keyframe_cache():
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = ProbeCache(os.path.join(get_cache_dir(), "keyframes.sqlite"))
+        return _default_index
+
+def build_keyframe_index(input_file):
+    # Packet flags only need demuxing, which is far cheaper than decoding frames
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,pix_fmt,width,height:packet=pts_time,flags:format=start_time",
+        "-of", "compact=p=0:nk=1",
+        input_file
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise Exception(f"Could not read keyframes from {input_file}: {result.stderr.strip()}")
+
+    # keyframe_packets holds each keyframe's position in decode order, which is how many packets precede it
+    index = {"codec": None, "pix_fmt": None, "width": 0, "height": 0, "keyframes": [], "keyframe_packets": []}
+    start_time = 0.0
+    packets = 0
+    keyframes = []
+    for line in result.stdout.splitlines():
+        fields = line.split("|")
+        if len(fields) == 2:
+            pts_time, flags = fields
+            if "K" in flags and pts_time not in ("", "N/A"):
+                keyframes.append((float(pts_time), packets))
+            packets += 1
+        elif len(fields) == 4:
+            index["codec"], index["width"], index["height"], index["pix_fmt"] = fields
+        elif len(fields) == 1 and fields[0] not in ("", "N/A"):
+            start_time = float(fields[0])
+    # Seeking with -ss is relative to the container start time, so the index is too
+    for keyframe, packet in sorted(keyframes):
+        index["keyframes"].append(keyframe - start_time)
+        index["keyframe_packets"].append(packet)
+    return index
+
+def keyframe_index(input_file, use_cache=True):
+    path = os.path.abspath(input_file)
+    stat = os.stat(path)
+    cache = get_keyframe_cache() if use_cache else None
+
+    if cache is not None:
+        index = cache.get(path, stat.st_size, stat.st_mtime_ns)
+        if index is not None:
+            return index
+
+    index = build_keyframe_index(path)
+    if cache is not None:
+        cache.put(path, stat.st_size, stat.st_mtime_ns, index)
+    return index
+
+def plan_smart_cut(index, start_time, end_time):
+    # (start, end, packets) pieces: whole GOPs inside the range are copied (packets is how many), the partial
+    # GOPs at each edge are re-encoded (packets is None)
+    keyframes = index["keyframes"]
+    first = bisect_left(keyframes, start_time)
+    last = bisect_right(keyframes, end_time) - 1
+    if first >= len(keyframes) or last < first or keyframes[first] >= keyframes[last]:
+        return [(start_time, end_time, None)]
+
+    copy_start, copy_end = keyframes[first], keyframes[last]
+    packets = index["keyframe_packets"][last] - index["keyframe_packets"][first]
+    pieces = []
+    if copy_start - start_time > MIN_EDGE_DURATION:
+        pieces.append((start_time, copy_start, None))
+    pieces.append((copy_start, copy_end, packets))
+    if end_time - copy_end > MIN_EDGE_DURATION:
+        pieces.append((copy_end, end_time, None))
+    return pieces
+
+def _escape_concat_path(path):
+    return path.replace("'", "'\\''")
+
+def smart_cut(input_file, output_file, start_time, end_time, control=None, use_cache=True):
+    index = keyframe_index(input_file, use_cache)
+    encoder = EDGE_ENCODERS.get(index["codec"])
+    if encoder is None:
+        return False
+
+    pieces = plan_smart_cut(index, start_time, end_time)
+    work_dir = tempfile.mkdtemp(prefix=".cut_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        list_file = os.path.join(work_dir, "parts.txt")
+        with open(list_file, "w") as f:
+            for number, (piece_start, piece_end, packets) in enumerate(pieces):
+                part_file = os.path.join(work_dir, f"part_{number}.{PART_CONTAINER}")
+                command = ["ffmpeg", "-ss", str(piece_start)]
+                if packets is not None:
+                    # With B-frames a time limit would also let in the next keyframe, which decodes before
+                    # the last frames of the range; counting packets in decode order stops exactly before it
+                    command += ["-i", input_file, "-map", "0:v:0", "-an", "-sn", "-dn",
+                                "-c:v", "copy", "-frames:v", str(packets)]
+                else:
+                    # trim drops the frame at the end point itself, where -t would round it into the part
+                    command += ["-i", input_file, "-map", "0:v:0", "-an", "-sn", "-dn",
+                                "-vf", f"trim=end={piece_end - piece_start}"]
+                    command += encoder + (["-pix_fmt", index["pix_fmt"]] if index["pix_fmt"] else [])
+                command += ["-y", part_file]
+                result = run_ffmpeg(command, piece_end - piece_start, control=control)
+                if result.returncode != 0:
+                    raise Exception(format_error("Smart cut failed while cutting the video.", result))
+                f.write(f"file '{_escape_concat_path(part_file)}'\n")
+
+        # Video from the joined parts; audio and other streams are copied straight from the source range
+        command = [
+            "ffmpeg",
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-ss", str(start_time), "-t", str(end_time - start_time), "-i", input_file,
+            "-map", "0:v:0", "-map", "1:a?",
+            "-c", "copy",
+            "-y", output_file
+        ]
+        result = run_ffmpeg(command, end_time - start_time, control=control)
+        if result.returncode != 0:
+            raise Exception(format_error("Smart cut failed while joining the parts.", result))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return True
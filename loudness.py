@@ -0,0 +1,96 @@
+import json
+import math
+import os
+import threading
+
+from backends import seek_args
+from output_cache import cache_key
+from probe import ProbeCache, probe
+from progress import format_error, run_ffmpeg
+from utils import get_cache_dir
+
+# EBU R128: integrated loudness in LUFS, true peak in dBTP, loudness range in LU
+DEFAULT_LOUDNESS_TARGET = -16.0
+DEFAULT_TRUE_PEAK = -1.5
+DEFAULT_LOUDNESS_RANGE = 11.0
+MEASUREMENT_FIELDS = ("input_i", "input_tp", "input_lra", "input_thresh")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_loudness_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache(os.path.join(get_cache_dir(), "loudness.sqlite"))
+        return _default_cache
+
+def parse_loudnorm_output(stderr):
+    # loudnorm prints its summary as the last JSON object in the log
+    start, end = stderr.rfind("{"), stderr.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = json.loads(stderr[start:end + 1])
+        return {field: float(data[field]) for field in MEASUREMENT_FIELDS}
+    except (ValueError, KeyError):
+        return None
+
+def measure_loudness(input_file, start_time=None, end_time=None, progress_callback=None, use_cache=True,
+                     control=None):
+    # The measurement does not depend on the target or the output format, so it is cached per input content
+    # and range and shared by every conversion of the same audio
+    key = None
+    if use_cache:
+        key = cache_key(input_file, {"operation": "loudness", "start": start_time, "end": end_time})
+        measurement = get_loudness_cache().get(key, 0, 0)
+        if measurement is not None:
+            if progress_callback:
+                progress_callback(100)
+            return measurement
+
+    if start_time is not None and end_time is not None:
+        inputs, duration = seek_args(input_file, start_time, end_time - start_time), end_time - start_time
+    else:
+        inputs, duration = seek_args(input_file), probe(input_file)["duration"]
+    # Only the first audio stream is demuxed and decoded
+    command = ["ffmpeg"] + inputs + [
+        "-map", "0:a:0", "-vn", "-sn", "-dn",
+        "-af", "loudnorm=print_format=json",
+        "-f", "null",
+        "-y", "-"
+    ]
+    result = run_ffmpeg(command, duration, progress_callback, control=control)
+    measurement = parse_loudnorm_output(result.stderr) if result.returncode == 0 else None
+    if measurement is None:
+        raise Exception(format_error(f"Could not measure the loudness of {input_file}.", result))
+
+    if key is not None:
+        get_loudness_cache().put(key, 0, 0, measurement)
+    return measurement
+
+def measure_many(items, workers=None, use_cache=True):
+    # items are (input_file, start_time, end_time); failures come back as None and surface again at conversion
+    from concurrent.futures import ThreadPoolExecutor
+
+    def safe_measure(item):
+        try:
+            return measure_loudness(*item, use_cache=use_cache)
+        except Exception:
+            return None
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(safe_measure, items))
+
+def loudnorm_filter(measurement, target=DEFAULT_LOUDNESS_TARGET, true_peak=DEFAULT_TRUE_PEAK,
+                    loudness_range=DEFAULT_LOUDNESS_RANGE, sample_rate=0):
+    options = f"I={target}:TP={true_peak}:LRA={loudness_range}"
+    # Silence measures as -inf, which loudnorm cannot take; it then falls back to a single dynamic pass
+    if all(math.isfinite(measurement[field]) for field in MEASUREMENT_FIELDS):
+        options += (f":measured_I={measurement['input_i']}:measured_TP={measurement['input_tp']}"
+                    f":measured_LRA={measurement['input_lra']}:measured_thresh={measurement['input_thresh']}"
+                    ":linear=true")
+    # loudnorm always outputs 192 kHz; aformat has the graph resample back to the source rate (an explicit
+    # aresample after loudnorm fails channel layout negotiation for some encoders)
+    return f"loudnorm={options}" + (f",aformat=sample_rates={sample_rate}" if sample_rate else "")
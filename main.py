@@ -1,8 +1,14 @@
 import sys
-from PyQt5.QtWidgets import QApplication
-from gui import MainWindow
 
 def main():
+    # Any arguments select the headless CLI; Qt is only imported for the GUI
+    if len(sys.argv) > 1:
+        from cli import main as cli_main
+        sys.exit(cli_main())
+
+    from PyQt5.QtWidgets import QApplication
+    from gui import MainWindow
+
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+
+from utils import get_cache_dir
+
+DEFAULT_METRICS_PORT = 9464
+WALL_TIME_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+REALTIME_FACTOR_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def job_metrics(input_file, output_file, output_format, mode, media_duration, probe_time, result, written_file=None):
+    event = result.last_event
+    return {
+        "time": time.time(),
+        "input_file": input_file,
+        "output_file": output_file,
+        "output_format": output_format,
+        "mode": mode,
+        "success": result.returncode == 0,
+        "media_duration": media_duration,
+        "probe_time": probe_time,
+        "wait_time": result.wait_time,
+        "spawn_latency": result.spawn_latency,
+        "wall_time": result.wall_time,
+        "cpu_time": result.cpu_time,
+        "peak_rss_kb": result.peak_rss_kb,
+        "realtime_factor": media_duration / result.wall_time if result.wall_time > 0 else 0.0,
+        "speed": event.speed if event else 0.0,
+        "bitrate": event.bitrate if event else 0.0,
+        "bytes_in": _size(input_file),
+        "bytes_out": _size(written_file or output_file),
+    }
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def render(self, name, labels):
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+class MetricsRecorder:
+    # Appends every job to a JSONL log and keeps per-format aggregates for the Prometheus endpoint
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), "metrics.jsonl")
+        self._lock = threading.Lock()
+        self._wall_time = {}
+        self._realtime_factor = {}
+        self._counters = {}
+
+    def record(self, metrics):
+        output_format = metrics["output_format"]
+        line = json.dumps(metrics) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+            self._wall_time.setdefault(output_format, Histogram(WALL_TIME_BUCKETS)).observe(metrics["wall_time"])
+            self._realtime_factor.setdefault(output_format, Histogram(REALTIME_FACTOR_BUCKETS)).observe(
+                metrics["realtime_factor"])
+            counters = self._counters.setdefault(output_format, {"jobs": 0, "failures": 0, "cpu_seconds": 0.0,
+                                                                 "bytes_in": 0, "bytes_out": 0})
+            counters["jobs"] += 1
+            counters["failures"] += 0 if metrics["success"] else 1
+            counters["cpu_seconds"] += metrics["cpu_time"]
+            counters["bytes_in"] += metrics["bytes_in"]
+            counters["bytes_out"] += metrics["bytes_out"]
+
+    def render(self):
+        # Prometheus expects the series of one metric family to be grouped under its TYPE line
+        lines = []
+        with self._lock:
+            formats = sorted(self._counters)
+            for name, histograms in (("video_converter_job_wall_seconds", self._wall_time),
+                                     ("video_converter_job_realtime_factor", self._realtime_factor)):
+                lines.append(f"# TYPE {name} histogram")
+                for output_format in formats:
+                    lines += histograms[output_format].render(name, f'format="{output_format}"')
+            for counter in ("jobs", "failures", "cpu_seconds", "bytes_in", "bytes_out"):
+                name = f"video_converter_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                for output_format in formats:
+                    lines.append(f'{name}{{format="{output_format}"}} {self._counters[output_format][counter]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=DEFAULT_METRICS_PORT, host="127.0.0.1"):
+        # Imported here so every conversion does not pay for http.server at start-up
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = recorder.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+_default_recorder = None
+_default_recorder_lock = threading.Lock()
+
+def get_metrics_recorder():
+    global _default_recorder
+    with _default_recorder_lock:
+        if _default_recorder is None:
+            _default_recorder = MetricsRecorder()
+        return _default_recorder
@@ -0,0 +1,165 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from utils import get_cache_dir
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Outputs above this share of the cap are not stored: they would evict most of the cache, or be evicted in the
+# same call when larger than the cap itself
+MAX_OBJECT_FRACTION = 0.25
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 16
+FICLONE = 0x40049409
+
+def fingerprint(path, block_size=SAMPLE_BLOCK_SIZE, blocks=SAMPLE_BLOCKS):
+    # Size plus a hash of evenly spaced blocks (always including the head and tail) instead of the whole file
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=20)
+    with open(path, "rb") as f:
+        if size <= block_size * blocks:
+            digest.update(f.read())
+        else:
+            step = (size - block_size) / (blocks - 1)
+            for index in range(blocks):
+                f.seek(int(index * step))
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+def cache_key(input_file, params):
+    digest = hashlib.blake2b(fingerprint(input_file).encode(), digest_size=20)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def _reflink(source, destination):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def place_file(source, destination, hardlink=False):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        _reflink(source, destination)
+        return "reflink"
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copyfile(source, destination)
+    return "copy"
+
+class OutputCache:
+    # Hardlinks are off by default: a later in-place write to the output would also change the cached object.
+    # Without reflink support, storing an output writes it a second time
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, hardlink=False):
+        self.directory = directory or os.path.join(get_cache_dir(), "outputs")
+        self.max_bytes = max_bytes
+        self.hardlink = hardlink
+        os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), timeout=30,
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, result TEXT, last_access REAL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+        self._connection.commit()
+
+    def _object_path(self, key):
+        return os.path.join(self.directory, "objects", key)
+
+    def _count(self, name):
+        self._connection.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def fetch(self, key, output_file):
+        with self._lock:
+            row = self._connection.execute("SELECT result FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(self._object_path(key)):
+                if row is not None:
+                    self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count("misses")
+                self._connection.commit()
+                return None
+            self._connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._count("hits")
+            self._connection.commit()
+
+        result = json.loads(row[0])
+        result["output_file"] = output_file
+        result["cached"] = place_file(self._object_path(key), output_file, self.hardlink)
+        return result
+
+    def store(self, key, output_file, result):
+        size = os.path.getsize(output_file)
+        if size > self.max_bytes * MAX_OBJECT_FRACTION:
+            return
+        temp_path = f"{self._object_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        place_file(output_file, temp_path)
+        os.replace(temp_path, self._object_path(key))
+
+        stored = {name: value for name, value in result.items() if name != "output_file"}
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (key, size, result, last_access) VALUES (?, ?, ?, ?)",
+                (key, size, json.dumps(stored), time.time()))
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._connection.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.remove(self._object_path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._connection.execute("SELECT name, value FROM stats").fetchall())
+            entries, total = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
+
+    def clear(self):
+        with self._lock:
+            for (key,) in self._connection.execute("SELECT key FROM entries").fetchall():
+                try:
+                    os.remove(self._object_path(key))
+                except FileNotFoundError:
+                    pass
+            self._connection.execute("DELETE FROM entries")
+            self._connection.execute("DELETE FROM stats")
+            self._connection.commit()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_output_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = OutputCache()
+        return _default_cache
@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+from utils import get_cache_dir
+
+MAX_CACHE_ENTRIES = 50000
+
+class ProbeCache:
+    def __init__(self, path=None, max_entries=MAX_CACHE_ENTRIES):
+        self.path = path or os.path.join(get_cache_dir(), "probe.sqlite")
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT, last_access REAL)")
+        self._connection.commit()
+
+    def get(self, path, size, mtime_ns):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, size, mtime_ns)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE probes SET last_access = ? WHERE path = ?", (time.time(), path))
+            self._connection.commit()
+        return json.loads(row[0])
+
+    def put(self, path, size, mtime_ns, info):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, data, last_access) VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, json.dumps(info), time.time()))
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        count = self._connection.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM probes WHERE path IN (SELECT path FROM probes ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM probes")
+            self._connection.commit()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_probe_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache()
+        return _default_cache
+
+def run_ffprobe(input_file):
+    command = [
+        "ffprobe",
+        "-v", "error",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        "-show_chapters",
+        input_file
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise Exception(f"Could not read media information from {input_file}: {result.stderr.strip()}")
+    return parse_probe_output(json.loads(result.stdout))
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+def parse_probe_output(data):
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    chapters = []
+    for chapter in data.get("chapters", []):
+        chapters.append({
+            "start": _to_float(chapter.get("start_time")),
+            "end": _to_float(chapter.get("end_time")),
+            "title": chapter.get("tags", {}).get("title", ""),
+        })
+
+    return {
+        "duration": _to_float(fmt.get("duration")),
+        "format_name": fmt.get("format_name", ""),
+        "bit_rate": _to_int(fmt.get("bit_rate")),
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "audio_bit_rate": _to_int(audio.get("bit_rate")),
+        "channels": _to_int(audio.get("channels")),
+        "sample_rate": _to_int(audio.get("sample_rate")),
+        "sample_fmt": audio.get("sample_fmt"),
+        # Significant bits, e.g. 24 for 24-bit audio decoded as s32; 0 when unknown
+        "bits_per_sample": _to_int(audio.get("bits_per_raw_sample")) or _to_int(audio.get("bits_per_sample")),
+        "audio_streams": sum(1 for s in streams if s.get("codec_type") == "audio"),
+        "chapters": chapters,
+    }
+
+def probe(input_file, use_cache=True):
+    path = os.path.abspath(input_file)
+    stat = os.stat(path)
+    cache = get_probe_cache() if use_cache else None
+
+    if cache is not None:
+        info = cache.get(path, stat.st_size, stat.st_mtime_ns)
+        # Entries cached before the sample format was recorded are probed again
+        if info is not None and "sample_fmt" in info:
+            return info
+
+    from backends import get_backend
+
+    info = get_backend().probe(path)
+    if cache is not None:
+        cache.put(path, stat.st_size, stat.st_mtime_ns, info)
+    return info
+
+def probe_many(input_files, workers=None, use_cache=True):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def safe_probe(input_file):
+        try:
+            return probe(input_file, use_cache)
+        except Exception:
+            return None
+
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(input_files, executor.map(safe_probe, input_files)))
@@ -0,0 +1,265 @@
+import collections
+import contextlib
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from governor import get_governor
+
+DEFAULT_PROGRESS_INTERVAL = 0.25
+STDERR_BUFFER_LINES = 200
+# How long ffmpeg gets to exit after SIGTERM before it is killed
+TERMINATE_TIMEOUT = 3.0
+
+class JobCancelled(Exception):
+    pass
+
+class JobControl:
+    # Shared between a job and whoever wants to stop it; every ffmpeg the job starts runs in its own process group
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self.cancelled = False
+        self.paused = False
+
+    def _signal(self, process, signum):
+        try:
+            os.killpg(process.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def attach(self, process):
+        with self._lock:
+            self._processes.add(process)
+            if self.cancelled:
+                self._terminate(process)
+            elif self.paused:
+                self._signal(process, signal.SIGSTOP)
+
+    def detach(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def _terminate(self, process):
+        self._signal(process, signal.SIGTERM)
+        # A stopped process only acts on SIGTERM once it is continued
+        self._signal(process, signal.SIGCONT)
+
+        def kill_if_alive():
+            if process.poll() is None:
+                self._signal(process, signal.SIGKILL)
+
+        timer = threading.Timer(TERMINATE_TIMEOUT, kill_if_alive)
+        timer.daemon = True
+        timer.start()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            self.paused = False
+            for process in self._processes:
+                self._terminate(process)
+
+    def pause(self):
+        with self._lock:
+            self.paused = True
+            for process in self._processes:
+                self._signal(process, signal.SIGSTOP)
+
+    def resume(self):
+        with self._lock:
+            self.paused = False
+            for process in self._processes:
+                self._signal(process, signal.SIGCONT)
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled("The job was cancelled.")
+
+    def checkpoint(self, interval=0.1):
+        # For work done in-process, where there is no ffmpeg process to stop or suspend
+        while self.paused and not self.cancelled:
+            time.sleep(interval)
+        self.check()
+
+def partial_path(output_file):
+    # Same directory (so the final rename is atomic) and same extension (so ffmpeg picks the same muxer)
+    directory, name = os.path.split(os.path.abspath(output_file))
+    base_name, ext = os.path.splitext(name)
+    return os.path.join(directory, f".{base_name}.part-{uuid.uuid4().hex[:8]}{ext}")
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class ProgressEvent:
+    def __init__(self, out_time, total_duration, speed, bitrate, total_size, finished):
+        self.out_time = out_time
+        self.total_duration = total_duration
+        self.speed = speed
+        self.bitrate = bitrate
+        self.total_size = total_size
+        self.finished = finished
+
+    @property
+    def percent(self):
+        if self.finished:
+            return 100
+        if self.total_duration <= 0:
+            return 0
+        return max(0, min(100, int(self.out_time / self.total_duration * 100)))
+
+    @property
+    def eta(self):
+        if self.finished:
+            return 0.0
+        if self.speed <= 0 or self.total_duration <= 0:
+            return None
+        return max(0.0, (self.total_duration - self.out_time) / self.speed)
+
+class FFmpegResult:
+    def __init__(self, returncode, stderr, last_event, wall_time=0.0, spawn_latency=0.0, cpu_time=0.0,
+                 peak_rss_kb=0, wait_time=0.0):
+        self.returncode = returncode
+        self.stderr = stderr
+        self.last_event = last_event
+        self.wall_time = wall_time
+        self.spawn_latency = spawn_latency
+        # From this child's own rusage, so concurrent jobs do not count each other's CPU time
+        self.cpu_time = cpu_time
+        self.peak_rss_kb = peak_rss_kb
+        # Time spent waiting for the resource governor before ffmpeg was started
+        self.wait_time = wait_time
+
+def _parse_number(value, suffix=""):
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+def parse_progress_block(fields, total_duration):
+    # out_time_ms is also reported in microseconds by ffmpeg, despite its name
+    out_time_us = fields.get("out_time_us", fields.get("out_time_ms", "0"))
+    return ProgressEvent(
+        out_time=_parse_number(out_time_us) / 1000000,
+        total_duration=total_duration,
+        speed=_parse_number(fields.get("speed", "0"), "x"),
+        bitrate=_parse_number(fields.get("bitrate", "0"), "kbits/s"),
+        total_size=int(_parse_number(fields.get("total_size", "0"))),
+        finished=fields.get("progress") == "end",
+    )
+
+def drain_stderr(stream, buffer):
+    for line in stream:
+        buffer.append(line.rstrip())
+
+_collecting = threading.local()
+
+@contextlib.contextmanager
+def collect_results():
+    # Gathers the result of every ffmpeg this thread runs inside the block, e.g. for per-run figures that
+    # process-wide rusage cannot give
+    previous = getattr(_collecting, "results", None)
+    _collecting.results = []
+    try:
+        yield _collecting.results
+    finally:
+        _collecting.results = previous
+
+def run_ffmpeg(command, total_duration=0.0, progress_callback=None, event_callback=None,
+               interval=DEFAULT_PROGRESS_INTERVAL, control=None):
+    if control is not None:
+        control.check()
+    governor = get_governor()
+    requested = time.monotonic()
+    profile, threads = governor.acquire(control) if governor is not None else (None, 0)
+    try:
+        return _run(command, total_duration, progress_callback, event_callback, interval, control, governor,
+                    profile, threads, time.monotonic() - requested)
+    finally:
+        if governor is not None:
+            governor.release(threads)
+
+@contextlib.contextmanager
+def governed_popen(command, control=None, **kwargs):
+    # For ffmpeg runs that are read through pipes instead of run_ffmpeg: the same admission, thread limit and
+    # priorities, with the governor's slot held until the block exits
+    governor = get_governor()
+    profile, threads = governor.acquire(control) if governor is not None else (None, 0)
+    try:
+        if governor is not None:
+            command = governor.prepare(command, threads)
+        process = subprocess.Popen(command, **kwargs)
+        if governor is not None:
+            governor.apply(process.pid, profile)
+        yield process
+    finally:
+        if governor is not None:
+            governor.release(threads)
+
+def _run(command, total_duration, progress_callback, event_callback, interval, control, governor, profile, threads,
+         wait_time):
+    if governor is not None:
+        command = governor.prepare(command, threads)
+    command = [command[0], "-nostats", "-nostdin", "-progress", "pipe:1"] + list(command[1:])
+    started = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                               start_new_session=True)
+    spawn_latency = time.monotonic() - started
+    if governor is not None:
+        governor.apply(process.pid, profile)
+    if control is not None:
+        control.attach(process)
+
+    stderr_buffer = collections.deque(maxlen=STDERR_BUFFER_LINES)
+    stderr_thread = threading.Thread(target=drain_stderr, args=(process.stderr, stderr_buffer), daemon=True)
+    stderr_thread.start()
+
+    fields = {}
+    last_event = None
+    last_emit = 0.0
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if not key:
+            continue
+        fields[key] = value
+        if key != "progress":
+            continue
+
+        last_event = parse_progress_block(fields, total_duration)
+        fields = {}
+        now = time.monotonic()
+        if last_event.finished or now - last_emit >= interval:
+            last_emit = now
+            if progress_callback:
+                progress_callback(last_event.percent)
+            if event_callback:
+                event_callback(last_event)
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.monotonic() - started
+    stderr_thread.join()
+    if control is not None:
+        control.detach(process)
+        control.check()
+    result = FFmpegResult(process.returncode, "\n".join(stderr_buffer), last_event, wall_time, spawn_latency,
+                          usage.ru_utime + usage.ru_stime, usage.ru_maxrss, wait_time)
+    collected = getattr(_collecting, "results", None)
+    if collected is not None:
+        collected.append(result)
+    return result
+
+def format_error(message, result, lines=5):
+    tail = result.stderr.strip().splitlines()[-lines:]
+    if not tail:
+        return message
+    return message + "\n" + "\n".join(tail)
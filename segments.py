@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import threading
+
+from conversion import check_ffmpeg, choose_audio_codec, get_audio_codec, time_to_seconds
+from probe import probe
+from progress import DEFAULT_PROGRESS_INTERVAL, discard, format_error, partial_path, run_ffmpeg
+
+# Chapters of inputs longer than this are split across processes, each decoding only its own run of chapters
+LONG_INPUT_DURATION = 3600.0
+
+def parse_time(value):
+    value = str(value).strip()
+    if ":" in value:
+        parts = value.split(":")
+        while len(parts) < 3:
+            parts.insert(0, "0")
+        return time_to_seconds(":".join(parts))
+    return float(value)
+
+def normalize_segments(segments):
+    normalized = []
+    for segment in segments:
+        if isinstance(segment, dict):
+            start, end, title = segment["start"], segment["end"], segment.get("title", "")
+        else:
+            start, end = segment[0], segment[1]
+            title = segment[2] if len(segment) > 2 else ""
+        start, end = parse_time(start), parse_time(end)
+        if end <= start:
+            raise Exception(f"Invalid segment {start}-{end}: the end time must be after the start time.")
+        normalized.append({"start": start, "end": end, "title": title or ""})
+    if not normalized:
+        raise Exception("No segments given.")
+    return normalized
+
+def load_segments(path):
+    with open(path, newline="") as f:
+        if os.path.splitext(path)[1].lower() == ".json":
+            return normalize_segments(json.load(f))
+
+        rows = [row for row in csv.reader(f) if row and not row[0].lstrip().startswith("#")]
+        if rows and rows[0][0].strip().lower() == "start":
+            rows = rows[1:]
+        return normalize_segments(rows)
+
+def chapter_segments(info):
+    segments = []
+    for number, chapter in enumerate(info["chapters"], 1):
+        end = min(chapter["end"], info["duration"]) if info["duration"] else chapter["end"]
+        if end > chapter["start"]:
+            segments.append({"start": chapter["start"], "end": end, "title": chapter["title"] or f"Chapter {number}"})
+    return segments
+
+def chapter_processes(info):
+    if info["duration"] <= LONG_INPUT_DURATION:
+        return 1
+    return max(1, min(os.cpu_count() or 1, len(info["chapters"])))
+
+def segment_output_files(output_file, count):
+    base_name, ext = os.path.splitext(output_file)
+    return [f"{base_name}_{index:02d}{ext}" for index in range(1, count + 1)]
+
+def _build_command(input_file, segments, output_format, output_files, concat, mode, source_codec, tracks=None,
+                   total_tracks=0):
+    # Seek once to the earliest segment and stop reading after the latest one
+    base = min(segment["start"] for segment in segments)
+    limit = max(segment["end"] for segment in segments) - base
+    command = ["ffmpeg", "-ss", str(base), "-t", str(limit), "-i", input_file]
+
+    if concat:
+        labels = [f"[s{index}]" for index in range(len(segments))]
+        filters = [f"[0:a:0]asplit={len(segments)}{''.join(labels)}"] if len(segments) > 1 else []
+        for index, segment in enumerate(segments):
+            source = labels[index] if len(segments) > 1 else "[0:a:0]"
+            filters.append(f"{source}atrim=start={segment['start'] - base}:end={segment['end'] - base},"
+                           f"asetpts=PTS-STARTPTS[t{index}]")
+        trimmed = "".join(f"[t{index}]" for index in range(len(segments)))
+        filters.append(f"{trimmed}concat=n={len(segments)}:v=0:a=1[out]")
+        command += ["-filter_complex", ";".join(filters), "-map", "[out]",
+                    "-acodec", get_audio_codec(output_format), "-y", output_files[0]]
+        return command, limit
+
+    codec, _ = choose_audio_codec(source_codec, output_format, mode)
+    for number, (segment, output_file) in enumerate(zip(segments, output_files)):
+        # The source's chapters would be copied into every track, pointing at the wrong times
+        command += ["-map", "0:a:0", "-map_chapters", "-1",
+                    "-ss", str(segment["start"] - base), "-to", str(segment["end"] - base),
+                    "-acodec", codec]
+        if segment["title"]:
+            command += ["-metadata", f"title={segment['title']}"]
+        if tracks:
+            command += ["-metadata", f"track={tracks[number]}/{total_tracks}"]
+        command += ["-y", output_file]
+    return command, limit
+
+def extract_segments(input_file, segments, output_format, output_files, progress_callback=None, concat=False,
+                     processes=1, mode="auto", event_callback=None, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                     control=None):
+    if not check_ffmpeg():
+        raise Exception("FFmpeg is not installed. Please install it using 'sudo apt-get install ffmpeg'.")
+
+    segments = normalize_segments(segments)
+    if isinstance(output_files, str):
+        output_files = [output_files] if concat else segment_output_files(output_files, len(segments))
+    if not concat and len(output_files) != len(segments):
+        raise Exception("Every segment needs its own output file.")
+
+    info = probe(input_file)
+    # Concatenation needs every segment in one filter graph, so it always runs as a single process
+    processes = 1 if concat else max(1, min(processes, len(segments)))
+
+    order = list(range(len(segments)))
+    if not concat:
+        order.sort(key=lambda index: segments[index]["start"])
+    # Contiguous runs of segments, so each process only decodes its own stretch of the timeline
+    size = -(-len(order) // processes)
+    groups = [order[i:i + size] for i in range(0, len(order), size)]
+    progress = [0] * len(groups)
+    errors = []
+    lock = threading.Lock()
+
+    def report(group_index, value):
+        with lock:
+            progress[group_index] = value
+            total = int(sum(progress) / len(progress))
+        if progress_callback:
+            progress_callback(total)
+
+    def run_group(group_index, group):
+        outputs = output_files if concat else [output_files[i] for i in group]
+        partial_files = [partial_path(output_file) for output_file in outputs]
+        command, duration = _build_command(input_file, [segments[i] for i in group], output_format, partial_files,
+                                           concat, mode, info["audio_codec"], [i + 1 for i in group], len(segments))
+        try:
+            result = run_ffmpeg(command, duration, lambda value: report(group_index, value),
+                                event_callback if len(groups) == 1 else None, progress_interval, control)
+            if result.returncode != 0:
+                with lock:
+                    errors.append(format_error("Segment extraction failed. Check the input file and time ranges.",
+                                               result))
+                return
+            for partial_file, output_file in zip(partial_files, outputs):
+                os.replace(partial_file, output_file)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        finally:
+            for partial_file in partial_files:
+                discard(partial_file)
+
+    if len(groups) == 1:
+        run_group(0, groups[0])
+    else:
+        threads = [threading.Thread(target=run_group, args=(index, group)) for index, group in enumerate(groups)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0] if isinstance(errors[0], Exception) else Exception(errors[0])
+    return output_files[:1] if concat else output_files
+
+def split_by_chapters(input_file, output_format, output_file, progress_callback=None, processes=None, mode="auto",
+                      event_callback=None, progress_interval=DEFAULT_PROGRESS_INTERVAL, control=None):
+    # One track per chapter, named like extracted segments and tagged with the chapter title and track number
+    info = probe(input_file)
+    segments = chapter_segments(info)
+    if not segments:
+        raise Exception(f"{input_file} has no chapters.")
+    if processes is None:
+        processes = chapter_processes(info)
+    return extract_segments(input_file, segments, output_format, output_file, progress_callback, False, processes,
+                            mode, event_callback, progress_interval, control)
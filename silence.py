@@ -0,0 +1,73 @@
+import numpy as np
+
+from conversion import convert_video_to_audio
+from segments import extract_segments
+from waveform import load_waveform
+
+DEFAULT_THRESHOLD_DB = -50.0
+DEFAULT_MIN_DURATION = 1.0
+# Silence kept on each side of a cut so speech onsets and decays are not clipped
+DEFAULT_PADDING = 0.25
+
+def detect_silence(rms_db, seconds_per_window, threshold_db=DEFAULT_THRESHOLD_DB, min_duration=DEFAULT_MIN_DURATION):
+    silent = np.concatenate(([False], rms_db < threshold_db, [False]))
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    long_enough = (ends - starts) * seconds_per_window >= min_duration
+    return [(start * seconds_per_window, end * seconds_per_window)
+            for start, end in zip(starts[long_enough].tolist(), ends[long_enough].tolist())]
+
+def keep_ranges(silences, duration, cut_internal=False, padding=DEFAULT_PADDING):
+    start, end = 0.0, duration
+    internal = []
+    for silence_start, silence_end in silences:
+        # Silent throughout; padding around the silence would otherwise keep a sliver of it
+        if silence_start <= 0 and silence_end >= duration:
+            return []
+        if silence_start <= 0:
+            start = max(start, silence_end - padding)
+        elif silence_end >= duration:
+            end = min(end, silence_start + padding)
+        else:
+            internal.append((silence_start + padding, silence_end - padding))
+
+    if not cut_internal:
+        return [(start, end)] if end > start else []
+
+    ranges = []
+    cursor = start
+    for silence_start, silence_end in internal:
+        if silence_end <= silence_start or silence_start <= cursor or silence_end >= end:
+            continue
+        ranges.append((cursor, silence_start))
+        cursor = silence_end
+    if end > cursor:
+        ranges.append((cursor, end))
+    return ranges
+
+def find_silence(input_file, threshold_db=DEFAULT_THRESHOLD_DB, min_duration=DEFAULT_MIN_DURATION):
+    # Reuses the cached waveform analysis, so only the first call decodes the file
+    waveform = load_waveform(input_file)
+    silences = detect_silence(waveform.rms_db, waveform.seconds_per_rms_window, threshold_db, min_duration)
+    return silences, waveform.duration
+
+def propose_trim(input_file, threshold_db=DEFAULT_THRESHOLD_DB, min_duration=DEFAULT_MIN_DURATION,
+                 cut_internal=False, padding=DEFAULT_PADDING):
+    silences, duration = find_silence(input_file, threshold_db, min_duration)
+    return keep_ranges(silences, duration, cut_internal, padding)
+
+def convert_without_silence(input_file, output_file, output_format, progress_callback=None,
+                            threshold_db=DEFAULT_THRESHOLD_DB, min_duration=DEFAULT_MIN_DURATION, cut_internal=False,
+                            padding=DEFAULT_PADDING, mode="auto", control=None):
+    ranges = propose_trim(input_file, threshold_db, min_duration, cut_internal, padding)
+    if not ranges:
+        raise Exception("The input is silent throughout; nothing to convert.")
+    if len(ranges) == 1:
+        result = convert_video_to_audio(input_file, output_file, output_format, progress_callback,
+                                        ranges[0][0], ranges[0][1], mode, control=control)
+    else:
+        extract_segments(input_file, ranges, output_format, output_file, progress_callback, concat=True,
+                         control=control)
+        result = {"output_file": output_file}
+    result["kept_ranges"] = ranges
+    return result
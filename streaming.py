@@ -0,0 +1,110 @@
+import collections
+import subprocess
+import threading
+
+from conversion import check_ffmpeg, check_time_range, get_audio_codec
+from progress import STDERR_BUFFER_LINES, drain_stderr, governed_popen
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Muxers that can be written to a non-seekable pipe
+STREAM_MUXERS = {
+    "mp3": ["-f", "mp3"],
+    "wav": ["-f", "wav"],
+    "ogg": ["-f", "ogg"],
+    "flac": ["-f", "flac"],
+    "aac": ["-f", "adts"],
+    "m4a": ["-f", "ipod", "-movflags", "frag_keyframe+empty_moov"],
+}
+
+def _iter_source(source, chunk_size):
+    if isinstance(source, (bytes, bytearray)):
+        for offset in range(0, len(source), chunk_size):
+            yield bytes(source[offset:offset + chunk_size])
+    elif hasattr(source, "read"):
+        while True:
+            data = source.read(chunk_size)
+            if not data:
+                return
+            yield data
+    else:
+        yield from source
+
+def _feed_stdin(source, stdin, chunk_size):
+    try:
+        # Writes block while ffmpeg's input pipe is full, which throttles reading from the source
+        for data in _iter_source(source, chunk_size):
+            stdin.write(data)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg exited or the generator was closed early; the exit status is reported by the reader
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+def stream_convert(source, output_format, chunk_size=DEFAULT_CHUNK_SIZE, start_time=None, end_time=None):
+    if not check_ffmpeg():
+        raise Exception("FFmpeg is not installed. Please install it using 'sudo apt-get install ffmpeg'.")
+    if output_format not in STREAM_MUXERS:
+        raise Exception(f"{output_format} cannot be streamed. Use one of: {', '.join(STREAM_MUXERS)}.")
+    check_time_range(start_time, end_time)
+
+    command = ["ffmpeg", "-hide_banner"]
+    if start_time is not None and end_time is not None:
+        command += ["-ss", str(start_time), "-t", str(end_time - start_time)]
+    # Containers that keep their index at the end (e.g. MP4 without faststart) cannot be read from a pipe; that
+    # is reported by _read_output once ffmpeg is done
+    command += ["-i", "pipe:0", "-vn", "-acodec", get_audio_codec(output_format)]
+    command += STREAM_MUXERS[output_format] + ["-y", "pipe:1"]
+    return _stream(command, source, chunk_size)
+
+def _stream(command, source, chunk_size):
+    # ffmpeg starts when the first chunk is asked for and holds its governor slot until the generator is done.
+    # A raw file descriptor is handed to ffmpeg directly; anything else is pumped through a bounded pipe
+    stdin = source if isinstance(source, int) else subprocess.PIPE
+    with governed_popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        bufsize=0) as process:
+        stderr_buffer = collections.deque(maxlen=STDERR_BUFFER_LINES)
+        threads = [threading.Thread(target=drain_stderr, args=(_text_lines(process.stderr), stderr_buffer),
+                                    daemon=True)]
+        if stdin == subprocess.PIPE:
+            threads.append(threading.Thread(target=_feed_stdin, args=(source, process.stdin, chunk_size),
+                                            daemon=True))
+        for thread in threads:
+            thread.start()
+
+        yield from _read_output(process, threads, stderr_buffer, chunk_size)
+
+def _text_lines(stream):
+    for line in stream:
+        yield line.decode("utf-8", errors="replace")
+
+def _read_output(process, threads, stderr_buffer, chunk_size):
+    finished = False
+    try:
+        while True:
+            data = process.stdout.read(chunk_size)
+            if not data:
+                break
+            yield data
+        process.wait()
+        finished = True
+    finally:
+        if not finished:
+            # The consumer stopped early: stop ffmpeg instead of letting it block on a full pipe
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        for thread in threads:
+            thread.join()
+
+    tail = "\n".join(list(stderr_buffer)[-5:])
+    if process.returncode != 0:
+        raise Exception(f"Streaming conversion failed. Check if the input stream is valid.\n{tail}".strip())
+    # ffmpeg exits cleanly after writing only the container header when it never found any audio, which is what
+    # an MP4/M4A with its index at the end (the usual layout without faststart) gives over a pipe
+    if any(line.startswith("Output file is empty") for line in stderr_buffer):
+        raise Exception("Streaming conversion produced no audio. Check if the input stream is valid; MP4 and M4A "
+                        "input must have its index at the start (-movflags faststart) to be read from a stream.")
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import cv2
+
+from keyframes import keyframe_index
+from utils import get_cache_dir
+
+THUMBNAIL_WIDTH = 160
+JPEG_QUALITY = 80
+# Seconds between thumbnails when there is no keyframe index, and the closest they are ever sampled
+THUMBNAIL_INTERVAL = 2.0
+MAX_THUMBNAILS = 300
+MEMORY_CACHE_ITEMS = 1024
+
+class ThumbnailCache:
+    # JPEG bytes keyed by (source key, millisecond): a memory LRU in front of one directory per source file
+    def __init__(self, directory=None, max_items=MEMORY_CACHE_ITEMS):
+        self.directory = directory or os.path.join(get_cache_dir(), "thumbnails")
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def _path(self, key, ms):
+        return os.path.join(self.directory, key, f"{ms}.jpg")
+
+    def stored(self, key):
+        try:
+            names = os.listdir(os.path.join(self.directory, key))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-4]) for name in names if name.endswith(".jpg") and name[:-4].isdigit())
+
+    def get(self, key, ms):
+        with self._lock:
+            data = self._items.get((key, ms))
+            if data is not None:
+                self._items.move_to_end((key, ms))
+                return data
+        try:
+            with open(self._path(key, ms), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._remember(key, ms, data)
+        return data
+
+    def put(self, key, ms, data):
+        path = self._path(key, ms)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self._remember(key, ms, data)
+
+    def _remember(self, key, ms, data):
+        with self._lock:
+            self._items[(key, ms)] = data
+            self._items.move_to_end((key, ms))
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_thumbnail_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ThumbnailCache()
+        return _default_cache
+
+def source_key(input_file):
+    path = os.path.abspath(input_file)
+    stat = os.stat(path)
+    return hashlib.blake2b(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=16).hexdigest()
+
+def sample_times(duration, keyframes=None, interval=THUMBNAIL_INTERVAL, limit=MAX_THUMBNAILS):
+    # Keyframes decode without touching any other frame, so they are the cheapest frames to show; fixed steps are
+    # the fallback, and the step also thins out files with very frequent keyframes
+    step = max(interval, duration / limit) if duration > 0 else interval
+    if keyframes:
+        times = []
+        for keyframe in keyframes:
+            if not times or keyframe - times[-1] >= step:
+                times.append(keyframe)
+        return times
+    return [index * step for index in range(int(duration / step) + 1)]
+
+def coarse_first(times, stride=16):
+    # A sparse pass over the whole file first, then filled in, so scrubbing has something to show early on
+    seen = set()
+    while stride >= 1:
+        for index in range(0, len(times), stride):
+            if index not in seen:
+                seen.add(index)
+                yield times[index]
+        stride //= 2
+
+class ThumbnailStrip:
+    def __init__(self, input_file, duration, cache=None, use_keyframes=True):
+        self.input_file = input_file
+        self.duration = duration
+        self.cache = cache or get_thumbnail_cache()
+        self.key = source_key(input_file)
+        self.use_keyframes = use_keyframes
+        self._lock = threading.Lock()
+        self._available = self.cache.stored(self.key)
+
+    def nearest(self, seconds):
+        # Whatever has been extracted so far; None until the first thumbnail exists
+        with self._lock:
+            if not self._available:
+                return None
+            ms = seconds * 1000
+            index = bisect_left(self._available, ms)
+            candidates = self._available[max(0, index - 1):index + 1]
+            best = min(candidates, key=lambda available: abs(available - ms))
+        return self.cache.get(self.key, best)
+
+    def _times(self):
+        keyframes = None
+        if self.use_keyframes:
+            try:
+                keyframes = keyframe_index(self.input_file)["keyframes"]
+            except Exception:
+                keyframes = None
+        return sample_times(self.duration, keyframes)
+
+    def extract(self, stop=None):
+        times = self._times()
+        capture = cv2.VideoCapture(self.input_file)
+        if not capture.isOpened():
+            raise Exception(f"Could not open {self.input_file} for thumbnails.")
+        try:
+            for time in coarse_first(times):
+                if stop is not None and stop():
+                    return
+                ms = int(round(time * 1000))
+                with self._lock:
+                    index = bisect_left(self._available, ms)
+                    if index < len(self._available) and self._available[index] == ms:
+                        continue
+                capture.set(cv2.CAP_PROP_POS_MSEC, ms)
+                ok, frame = capture.read()
+                if not ok:
+                    continue
+                height, width = frame.shape[:2]
+                size = (THUMBNAIL_WIDTH, max(1, round(height * THUMBNAIL_WIDTH / width)))
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                ok, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if not ok:
+                    continue
+                self.cache.put(self.key, ms, data.tobytes())
+                with self._lock:
+                    index = bisect_left(self._available, ms)
+                    self._available.insert(index, ms)
+        finally:
+            capture.release()
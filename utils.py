@@ -1,14 +1,68 @@
 import os
-import magic
+import threading
+
+# libmagic only needs the container header to identify media files
+HEADER_BYTES = 8192
+MEDIA_MIME_PREFIXES = ('video/', 'audio/')
+MEDIA_MIME_TYPES = {'application/ogg', 'application/mp4', 'application/x-matroska', 'application/vnd.rn-realmedia'}
+# Types libmagic reports when it cannot tell; ffprobe decides for these
+AMBIGUOUS_MIME_TYPES = {'application/octet-stream', 'application/x-data'}
+
+_local = threading.local()
+
+def _get_magic():
+    # magic.Magic handles are expensive to build and not thread-safe, so keep one per thread
+    mime = getattr(_local, "mime", None)
+    if mime is None:
+        import magic
+
+        mime = _local.mime = magic.Magic(mime=True)
+    return mime
+
+def sniff_mime_type(file_path):
+    with open(file_path, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+    return _get_magic().from_buffer(header)
 
 def is_valid_video_file(file_path):
-    mime = magic.Magic(mime=True)
-    file_type = mime.from_file(file_path)
-    return file_type.startswith('video/')
+    try:
+        file_type = sniff_mime_type(file_path)
+    except OSError:
+        return False
+    if file_type.startswith(MEDIA_MIME_PREFIXES) or file_type in MEDIA_MIME_TYPES:
+        return True
+    if file_type not in AMBIGUOUS_MIME_TYPES:
+        return False
+
+    from probe import probe
+
+    try:
+        info = probe(file_path)
+    except Exception:
+        return False
+    return bool(info["audio_codec"] or info["video_codec"])
+
+def validate_many(file_paths, workers=None):
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(file_paths, executor.map(is_valid_video_file, file_paths)))
 
 def get_file_size(file_path):
     return os.path.getsize(file_path)
 
-def estimate_conversion_time(file_size):
+def estimate_conversion_time(file_size, duration=None, output_format=None, mode="transcode"):
+    if duration and output_format:
+        from estimator import predict_conversion_time
+
+        # Learned from recorded jobs; returns (estimate, lower bound, upper bound)
+        return predict_conversion_time(duration, output_format, mode)[0]
     # This is a very rough estimate and should be adjusted based on actual performance
-    return file_size / (5 * 1024 * 1024)  # Assume 5 MB/s conversion rate
\ No newline at end of file
+    return file_size / (5 * 1024 * 1024)  # Assume 5 MB/s conversion rate
+
+def get_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    cache_dir = os.path.join(base, "video-converter")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
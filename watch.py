@@ -0,0 +1,287 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import set_backend
+from batch import BatchJob, default_worker_count
+from governor import Governor, set_governor
+from utils import get_cache_dir, is_valid_video_file
+
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_POLL_INTERVAL = 2.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_MODIFY = 0x00000002
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class WatchRule:
+    def __init__(self, path, output_format="mp3", output_dir=None, start_time=None, end_time=None, mode="auto"):
+        self.path = os.path.abspath(path)
+        self.output_format = output_format
+        self.output_dir = os.path.abspath(output_dir) if output_dir else self.path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.mode = mode
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["path"], data.get("format", "mp3"), data.get("output_dir"),
+                   data.get("start"), data.get("end"), data.get("mode", "auto"))
+
+    def output_file_for(self, input_file):
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        return os.path.join(self.output_dir, f"{base_name}.{self.output_format}")
+
+class Journal:
+    # Append-only JSONL of state changes; the last entry per file key wins
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.states = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        continue
+                    self.states[entry["key"]] = entry
+        self.outputs = {entry["output_file"] for entry in self.states.values() if entry.get("output_file")}
+        self._compact()
+        self._file = open(path, "a")
+
+    def _compact(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            for entry in self.states.values():
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def state(self, key):
+        entry = self.states.get(key)
+        return entry["state"] if entry else None
+
+    def pending(self):
+        return [entry for entry in self.states.values() if entry["state"] in ("queued", "running")]
+
+    def record(self, key, path, state, **fields):
+        entry = dict(fields, key=key, path=path, state=state, time=time.time())
+        with self._lock:
+            self.states[key] = entry
+            if entry.get("output_file"):
+                self.outputs.add(entry["output_file"])
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+def file_key(path, stat):
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+class InotifyWatcher:
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        for directory in directories:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+            if wd < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self._directories[wd] = directory
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name and wd in self._directories:
+                paths.append(os.path.join(self._directories[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    def __init__(self, directories, interval=DEFAULT_POLL_INTERVAL):
+        self._directories = list(directories)
+        self._interval = interval
+        self._seen = {}
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self._interval))
+        paths = []
+        for directory in self._directories:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                # Only report files that are new or still changing
+                if self._seen.get(entry.path) != signature:
+                    self._seen[entry.path] = signature
+                    paths.append(entry.path)
+        return paths
+
+    def close(self):
+        pass
+
+def create_watcher(directories, poll_interval=DEFAULT_POLL_INTERVAL):
+    try:
+        return InotifyWatcher(directories)
+    except (OSError, AttributeError):
+        return PollingWatcher(directories, poll_interval)
+
+class WatchDaemon:
+    def __init__(self, rules, workers=None, settle_seconds=DEFAULT_SETTLE_SECONDS, journal_path=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, job_callback=None):
+        self.rules = {rule.path: rule for rule in rules}
+        self.workers = workers or default_worker_count()
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.job_callback = job_callback
+        self.journal = Journal(journal_path or os.path.join(get_cache_dir(), "watch-journal.jsonl"))
+        self._candidates = {}
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _rule_for(self, path):
+        return self.rules.get(os.path.dirname(os.path.abspath(path)))
+
+    def _observe(self, path):
+        if os.path.basename(path).startswith(".") or self._rule_for(path) is None:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._candidates.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self._candidates.get(path)
+        if previous is None or previous[0] != signature:
+            self._candidates[path] = (signature, time.monotonic())
+
+    def _settled(self):
+        ready = []
+        now = time.monotonic()
+        for path, (signature, since) in list(self._candidates.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                self._candidates[path] = ((stat.st_size, stat.st_mtime_ns), now)
+            elif now - since >= self.settle_seconds:
+                del self._candidates[path]
+                ready.append((path, stat))
+        return ready
+
+    def _submit(self, executor, path, stat):
+        key = file_key(path, stat)
+        with self._lock:
+            if key in self._active or self.journal.state(key) in ("done", "failed", "invalid"):
+                return
+            # Outputs written into a watched folder must not be picked up as new inputs
+            if path in self.journal.outputs:
+                return
+            if stat.st_size == 0 or not is_valid_video_file(path):
+                self.journal.record(key, path, "invalid")
+                return
+            self._active.add(key)
+        rule = self._rule_for(path)
+        self.journal.record(key, path, "queued", output_file=rule.output_file_for(path))
+        executor.submit(self._convert, key, path, rule)
+
+    def _convert(self, key, path, rule):
+        job = BatchJob(path, rule.output_file_for(path), rule.output_format, rule.start_time, rule.end_time,
+                       mode=rule.mode)
+        self.journal.record(key, path, "running", output_file=job.output_file)
+        try:
+            os.makedirs(rule.output_dir, exist_ok=True)
+            job.run(lambda value: None)
+            job.status = "done"
+            self.journal.record(key, path, "done", output_file=job.output_file)
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            self.journal.record(key, path, "failed", output_file=job.output_file, error=job.error)
+        finally:
+            with self._lock:
+                self._active.discard(key)
+        if self.job_callback:
+            self.job_callback(job)
+
+    def run(self):
+        watcher = create_watcher(self.rules.keys(), self.poll_interval)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # Resume work that was queued or running when the daemon last stopped
+                for entry in self.journal.pending():
+                    try:
+                        stat = os.stat(entry["path"])
+                    except FileNotFoundError:
+                        continue
+                    if file_key(entry["path"], stat) == entry["key"]:
+                        self._submit(executor, entry["path"], stat)
+
+                for directory in self.rules:
+                    for entry in os.scandir(directory):
+                        if entry.is_file():
+                            self._observe(entry.path)
+
+                while not self._stop.is_set():
+                    for path in watcher.wait(min(self.poll_interval, self.settle_seconds)):
+                        self._observe(path)
+                    for path, stat in self._settled():
+                        self._submit(executor, path, stat)
+        finally:
+            watcher.close()
+            self.journal.close()
+
+def load_watch_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    rules = [WatchRule.from_dict(folder) for folder in config["folders"]]
+    # The resource policy can live in the same file, so one config describes the whole service
+    if "policy" in config:
+        set_governor(Governor.from_dict(config["policy"]))
+    if "backend" in config:
+        set_backend(config["backend"])
+    return WatchDaemon(rules, config.get("workers"), config.get("settle_seconds", DEFAULT_SETTLE_SECONDS),
+                       config.get("journal"), config.get("poll_interval", DEFAULT_POLL_INTERVAL))
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import subprocess
+
+import numpy as np
+
+from progress import governed_popen
+from utils import get_cache_dir
+
+PCM_SAMPLE_RATE = 8000
+SAMPLES_PER_BUCKET = 64
+ZOOM_LEVELS = 5
+ZOOM_FACTOR = 4
+RMS_WINDOW_SAMPLES = 400
+READ_SAMPLES = 1 << 16
+
+def iter_pcm(input_file, sample_rate=PCM_SAMPLE_RATE, read_samples=READ_SAMPLES, stop=None):
+    # Low-rate mono PCM is plenty for overviews and analysis, and cheap to stream; stop is checked between reads
+    # and ends the stream early
+    command = [
+        "ffmpeg", "-v", "error",
+        "-i", input_file,
+        "-vn", "-ac", "1", "-ar", str(sample_rate),
+        "-f", "s16le", "-y", "pipe:1"
+    ]
+    with governed_popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        try:
+            while True:
+                if stop is not None and stop():
+                    return
+                data = process.stdout.read(read_samples * 2)
+                if not data:
+                    break
+                yield np.frombuffer(data[:len(data) - len(data) % 2], dtype=np.int16)
+            # A decode that failed part way (or never started) would otherwise pass for short or empty audio
+            if process.wait() != 0:
+                raise Exception(f"Could not decode the audio of {input_file}.")
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+class PeakAccumulator:
+    # Reduces a stream of PCM chunks to per-bucket min/max without holding the PCM in memory
+    def __init__(self, samples_per_bucket=SAMPLES_PER_BUCKET):
+        self.samples_per_bucket = samples_per_bucket
+        self._leftover = np.empty(0, dtype=np.int16)
+        self._mins = []
+        self._maxs = []
+
+    def add(self, samples):
+        samples = np.concatenate((self._leftover, samples)) if len(self._leftover) else samples
+        usable = len(samples) - len(samples) % self.samples_per_bucket
+        if usable:
+            buckets = samples[:usable].reshape(-1, self.samples_per_bucket)
+            self._mins.append(buckets.min(axis=1))
+            self._maxs.append(buckets.max(axis=1))
+        self._leftover = samples[usable:].copy()
+
+    def finish(self):
+        if len(self._leftover):
+            self._mins.append(self._leftover.min(keepdims=True))
+            self._maxs.append(self._leftover.max(keepdims=True))
+            self._leftover = np.empty(0, dtype=np.int16)
+        if not self._mins:
+            return np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)
+        return np.concatenate(self._mins), np.concatenate(self._maxs)
+
+class RmsAccumulator:
+    # Loudness per fixed window in dBFS, kept alongside the peaks so silence can be found without decoding again
+    def __init__(self, window_samples=RMS_WINDOW_SAMPLES):
+        self.window_samples = window_samples
+        self._leftover = np.empty(0, dtype=np.int16)
+        self._levels = []
+
+    def _rms_db(self, windows):
+        rms = np.sqrt(np.mean(np.square(windows, dtype=np.float32), axis=-1))
+        return (20 * np.log10(np.maximum(rms, 1.0) / 32768)).astype(np.float32)
+
+    def add(self, samples):
+        samples = np.concatenate((self._leftover, samples)) if len(self._leftover) else samples
+        usable = len(samples) - len(samples) % self.window_samples
+        if usable:
+            self._levels.append(self._rms_db(samples[:usable].reshape(-1, self.window_samples)))
+        self._leftover = samples[usable:].copy()
+
+    def finish(self):
+        if len(self._leftover):
+            self._levels.append(self._rms_db(self._leftover)[np.newaxis])
+            self._leftover = np.empty(0, dtype=np.int16)
+        if not self._levels:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self._levels)
+
+def _reduce(values, factor, function):
+    pad = (-len(values)) % factor
+    if pad:
+        values = np.concatenate((values, np.repeat(values[-1:], pad)))
+    return function(values.reshape(-1, factor), axis=1)
+
+class Waveform:
+    def __init__(self, levels, seconds_per_bucket, rms_db, seconds_per_rms_window):
+        # levels[0] is the finest; each following level is ZOOM_FACTOR times coarser
+        self.levels = levels
+        self.seconds_per_bucket = seconds_per_bucket
+        self.rms_db = rms_db
+        self.seconds_per_rms_window = seconds_per_rms_window
+
+    @property
+    def duration(self):
+        return len(self.rms_db) * self.seconds_per_rms_window
+
+    @classmethod
+    def from_peaks(cls, mins, maxs, seconds_per_bucket, rms_db, seconds_per_rms_window):
+        levels = [(mins, maxs)]
+        for _ in range(ZOOM_LEVELS - 1):
+            mins, maxs = levels[-1]
+            if len(mins) <= ZOOM_FACTOR:
+                break
+            levels.append((_reduce(mins, ZOOM_FACTOR, np.min), _reduce(maxs, ZOOM_FACTOR, np.max)))
+        return cls(levels, seconds_per_bucket, rms_db, seconds_per_rms_window)
+
+    def peaks(self, width):
+        # Coarsest level that still has at least one bucket per pixel, then reduce to exactly one per pixel
+        mins, maxs = self.levels[0]
+        for level_mins, level_maxs in self.levels:
+            if len(level_mins) >= width:
+                mins, maxs = level_mins, level_maxs
+        if len(mins) <= width or width <= 0:
+            return mins, maxs
+        edges = np.linspace(0, len(mins), width + 1).astype(np.intp)[:-1]
+        return np.minimum.reduceat(mins, edges), np.maximum.reduceat(maxs, edges)
+
+    def save(self, path):
+        arrays = {}
+        for index, (mins, maxs) in enumerate(self.levels):
+            arrays[f"min_{index}"] = mins
+            arrays[f"max_{index}"] = maxs
+        temp_path = path + ".tmp.npz"
+        np.savez_compressed(temp_path, seconds_per_bucket=self.seconds_per_bucket, rms_db=self.rms_db,
+                            seconds_per_rms_window=self.seconds_per_rms_window, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            levels = []
+            while f"min_{len(levels)}" in data:
+                levels.append((data[f"min_{len(levels)}"], data[f"max_{len(levels)}"]))
+            return cls(levels, float(data["seconds_per_bucket"]), data["rms_db"],
+                       float(data["seconds_per_rms_window"]))
+
+def _cache_path(input_file):
+    path = os.path.abspath(input_file)
+    stat = os.stat(path)
+    key = hashlib.blake2b(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=16).hexdigest()
+    directory = os.path.join(get_cache_dir(), "waveforms")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{key}.npz")
+
+def compute_waveform(input_file, stop=None):
+    # None when stopped, since the audio read so far is only part of the file
+    peaks = PeakAccumulator()
+    loudness = RmsAccumulator()
+    for samples in iter_pcm(input_file, stop=stop):
+        peaks.add(samples)
+        loudness.add(samples)
+    if stop is not None and stop():
+        return None
+    mins, maxs = peaks.finish()
+    return Waveform.from_peaks(mins, maxs, SAMPLES_PER_BUCKET / PCM_SAMPLE_RATE,
+                               loudness.finish(), RMS_WINDOW_SAMPLES / PCM_SAMPLE_RATE)
+
+def load_waveform(input_file, use_cache=True, stop=None):
+    cache_path = _cache_path(input_file) if use_cache else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            return Waveform.load(cache_path)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    waveform = compute_waveform(input_file, stop)
+    if cache_path and waveform is not None:
+        waveform.save(cache_path)
+    return waveform